@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Multi-hole batch sequencer
+Drills a list of hole programs (depth and peck parameters per hole) with an
+operator reposition prompt between holes. The relay and pump stay armed for
+the whole batch (pump at BATCH_IDLE_DUTY between holes), and setup work is
+pipelined with the operator: while the prompt waits, a background thread
+lifts the tool to the clearance plane, or re-homes when it is due (every
+BATCH_REHOME_EVERY holes, or after a fault). Only the motion still running
+after the operator confirms adds to the cycle.
+
+Geometry (HOME_DIR_UP): home is the top limit, the work surface is
+BATCH_SURFACE_MM below it, the tool waits BATCH_CLEAR_MM above the surface.
+
+Reports per-hole and per-batch times and a takt breakdown:
+    operator   prompt shown → confirmed (home/lift run underneath)
+    wait       motion (or pump prime) still running after the confirm
+    approach   clearance plane → work surface
+    cycle      peck cycle incl. withdraw (cut/retract/dwell/return/reapproach)
+
+Usage:
+    python3 batch.py holes.json              # [{"name": "A1", "depth_mm": 1.5, "prompt": "..."}, ...]
+    python3 batch.py --holes 4               # four config.py holes
+    python3 batch.py --sim --holes 6 --operator-s 8     # simulated machine and operator
+    python3 batch.py holes.json --record data/b1.jsonl   # data/b1_<hole>.jsonl per hole for replay.py
+"""
+import argparse, json, sys, threading, time
+
+from config import (TARGET_DEPTH_MM, ECM_FEED_MM_S, ECM_VOLTAGE_V, PUMP_DUTY_RUN, PECK_RAPID_MM_S,
+                    PECK_CLEARANCE_MM, BATCH_SURFACE_MM, BATCH_CLEAR_MM, BATCH_REHOME_EVERY,
+                    BATCH_IDLE_DUTY, BATCH_PRIME_S)
+import cycle
+from jobserver import validate
+from recorder import Recorder, hole_path
+
+STAGES = ("home", "lift", "operator", "wait", "approach", "cycle")
+
+class BatchQuit(Exception):
+    pass
+
+class Hole:
+    """One hole program: job-style params (validated like POST /jobs) plus a prompt."""
+    def __init__(self, params: dict, index: int = 0):
+        p = dict(params)
+        self.name = str(p.pop("name", f"#{index + 1}"))
+        self.prompt = p.pop("prompt", None)
+        self.params = validate(p)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            data = json.load(f)
+        return [cls(p, k) for k, p in enumerate(data)]
+
+class HoleResult:
+    def __init__(self, hole: Hole):
+        self.hole = hole
+        self.t = {s: 0.0 for s in STAGES}
+        self.stats = None
+        self.skipped = False
+        self.fault = None
+
+    @property
+    def takt_s(self) -> float:
+        """Wall time this hole added: everything except the stages hidden under the prompt."""
+        return sum(self.t[s] for s in ("operator", "wait", "approach", "cycle"))
+
+    def as_dict(self) -> dict:
+        d = {"name": self.hole.name, "skipped": self.skipped, "fault": self.fault,
+             "takt_s": round(self.takt_s, 3)}
+        d.update({f"{s}_s": round(v, 3) for s, v in self.t.items()})
+        if self.stats is not None:
+            d["cycle"] = self.stats.as_dict()
+        return d
+
+class BatchReport:
+    def __init__(self, results, setup_s: float, wall_s: float):
+        self.results = results
+        self.setup_s = setup_s
+        self.wall_s = wall_s
+        self.clock_error_s = None       # --sim: summed sleep overshoot of the RealtimeClock
+
+    def as_dict(self) -> dict:
+        drilled = [r for r in self.results if not r.skipped]
+        done = [r for r in drilled if r.stats is not None and r.stats.complete]
+        tot = {s: sum(r.t[s] for r in self.results) for s in STAGES}
+        hidden = tot["home"] + tot["lift"] - tot["wait"]
+        return {
+            "holes": len(self.results),
+            "done": len(done),
+            "failed": len(drilled) - len(done),
+            "skipped": len(self.results) - len(drilled),
+            "setup_s": round(self.setup_s, 3),
+            "wall_s": round(self.wall_s, 3),
+            "takt_s": round(sum(r.takt_s for r in drilled) / len(drilled), 3) if drilled else 0.0,
+            "takt_clock_error_s": (round(self.clock_error_s / len(drilled), 3)
+                                   if self.clock_error_s is not None and drilled else None),
+            "holes_per_hour": round(3600.0 * len(done) / self.wall_s, 2) if self.wall_s else 0.0,
+            "stages_s": {s: round(v, 3) for s, v in tot.items()},
+            "overlap_saved_s": round(max(0.0, hidden), 3),
+            "per_hole": [r.as_dict() for r in self.results],
+        }
+
+    def __str__(self):
+        d = self.as_dict()
+        lines = [f"[BATCH] {'hole':<8}{'takt':>8}{'oper':>8}{'wait':>7}{'appr':>7}{'cycle':>8}"
+                 f"{'home':>7}{'lift':>7}  result"]
+        for r in self.results:
+            res = ("skipped" if r.skipped else r.fault if r.fault else
+                   f"ok {r.stats.depth_mm:.3f}mm {r.stats.pecks} pecks")
+            t = r.t
+            lines.append(f"[BATCH] {r.hole.name:<8}{r.takt_s:8.1f}{t['operator']:8.1f}{t['wait']:7.1f}"
+                         f"{t['approach']:7.1f}{t['cycle']:8.1f}{t['home']:7.1f}{t['lift']:7.1f}  {res}")
+        st = d["stages_s"]
+        busy = sum(st[s] for s in ("operator", "wait", "approach", "cycle")) or 1.0
+        parts = "  ".join(f"{s}={st[s]:.1f}s({100*st[s]/busy:.0f}%)"
+                          for s in ("operator", "wait", "approach", "cycle"))
+        err = d["takt_clock_error_s"]
+        lines.append(f"[BATCH] done={d['done']} failed={d['failed']} skipped={d['skipped']}  "
+                     f"setup={d['setup_s']:.1f}s  wall={d['wall_s']:.1f}s  takt={d['takt_s']:.1f}s/hole"
+                     + (f" (sim clock ≤ +{err:.2f}s)" if err is not None else "") +
+                     f"  ({d['holes_per_hour']:.0f} holes/h)")
+        lines.append(f"[BATCH] takt: {parts}")
+        lines.append(f"[BATCH] home/lift hidden under operator: {d['overlap_saved_s']:.1f}s")
+        return "\n".join(lines)
+
+def _console_prompt(text: str) -> str:
+    return input(text)
+
+class BatchSequencer:
+    """
+    Runs `holes` back to back on one set of controllers. `prompt(text)` returns
+    the operator's answer ("" continue, "s" skip, "q" quit); it runs on the
+    calling thread while motion runs on a worker thread, so it may block.
+    """
+    def __init__(self, motion, pump, instr=None, holes=(), safety=None, guards=(),
+                 rehome_every: int = BATCH_REHOME_EVERY, catalog=None, prompt=_console_prompt,
+                 clock=time.monotonic, sleep=time.sleep, on_progress=None, flow=None, recorder=None,
+                 make_guard=None):
+        self.motion = motion
+        self.pump = pump
+        self.recorder = recorder            # recorder.Recorder wrapping motion/pump/instr: one file per hole
+        self._record_base = recorder.path if recorder is not None else None
+        self.flow = flow                    # FlowController: owns pump duty while cutting
+        self.instr = instr
+        self.holes = list(holes)
+        self.safety = safety
+        self.guards = tuple(guards)
+        self._Guard = make_guard            # motion.Guard: stop guard for the setup worker (None → sim)
+        self.rehome_every = int(rehome_every)
+        self.catalog = catalog
+        self.prompt = prompt
+        self.now = clock
+        self._sleep = sleep
+        self.on_progress = on_progress
+        self.results = []
+        self._homed = False
+        self._since_home = 0
+        self._fault = False
+        self._primed_at = None
+        self._feed = ECM_FEED_MM_S
+
+    # ---- motion stages ----
+    def _timed(self, res, stage, fn, *args):
+        t0 = self.now()
+        try:
+            return fn(*args)
+        finally:
+            res.t[stage] += self.now() - t0
+
+    def _move(self, mm, feed, guards=None) -> bool:
+        """False if a guard stopped the move short."""
+        want = self.motion.profile.steps(mm)
+        moved = self.motion.move_mm(mm, feed, self.guards if guards is None else guards)
+        return moved is None or moved >= want
+
+    def _home(self, guards=None):
+        """Home and park at the clearance plane."""
+        guards = self.guards if guards is None else guards
+        self.motion.set_enabled(True)
+        if self.motion.home(guards) is False:
+            raise RuntimeError("homing stopped")
+        if not self._move(-(BATCH_SURFACE_MM - BATCH_CLEAR_MM), PECK_RAPID_MM_S, guards):
+            raise RuntimeError("guard tripped moving to the clearance plane")
+        self._homed = True
+        self._since_home = 0
+        self._fault = False
+
+    def _lift(self, from_mm: float, guards=None):
+        """Withdrawn tool (from_mm above the surface) → clearance plane."""
+        if BATCH_CLEAR_MM > from_mm and not self._move(BATCH_CLEAR_MM - from_mm, PECK_RAPID_MM_S, guards):
+            raise RuntimeError("guard tripped lifting to the clearance plane")
+
+    def _approach(self):
+        """Clearance plane → work surface; last PECK_CLEARANCE_MM at cutting feed."""
+        rapid = BATCH_CLEAR_MM - PECK_CLEARANCE_MM
+        if rapid > 0 and not self._move(-rapid, PECK_RAPID_MM_S):
+            return False
+        return self._move(-min(PECK_CLEARANCE_MM, BATCH_CLEAR_MM), self._feed)
+
+    def _rehome_due(self) -> bool:
+        return (not self._homed or self._fault or
+                (self.rehome_every > 0 and self._since_home >= self.rehome_every))
+
+    def _setup_motion(self, res, parked_mm, stop):
+        """Background stage run under the operator prompt; `stop` (Event) aborts it."""
+        guards = self.guards
+        if self._Guard is not None:
+            guards += (self._Guard("stop", stop.is_set, message="[BATCH] setup stopped"),)
+        if stop.is_set():
+            raise RuntimeError("setup stopped")
+        if self._rehome_due():
+            self._timed(res, "home", self._home, guards)
+        elif parked_mm is not None:
+            self._timed(res, "lift", self._lift, parked_mm, guards)
+
+    # ---- operator ----
+    def _ask(self, k: int, hole: Hole) -> str:
+        text = hole.prompt or f"Position part for hole {hole.name}"
+        return (self.prompt(f"[BATCH] ({k + 1}/{len(self.holes)}) {text} – Enter=drill, s=skip, q=quit: ")
+                or "").strip().lower()
+
+    def _clear_estop(self):
+        if self.safety is not None and self.safety.estop_active():
+            print("[SAFETY] E-STOP active – release it to continue the batch.")
+            self.safety.wait_clear()
+            self.safety.relay_on()
+
+    # ---- batch ----
+    def _arm(self):
+        if self.safety is not None:
+            self.safety.relay_on()
+        self.pump.set_duty(BATCH_IDLE_DUTY)
+        self._primed_at = self.now()
+
+    def _wait_primed(self):
+        left = BATCH_PRIME_S - (self.now() - self._primed_at)
+        if left > 0:
+            self._sleep(left)
+
+    def _drill(self, res: HoleResult):
+        p = res.hole.params
+        run = None
+        if self.catalog is not None:
+            run = self.catalog.start_run("batch", note=f"hole {res.hole.name}",
+                                         voltage_V=ECM_VOLTAGE_V, depth_mm=p["depth_mm"],
+                                         feed_mm_s=p.get("feed_mm_s"),
+                                         pump_duty=p.get("pump_duty", PUMP_DUTY_RUN))
+
+        def progress(cyc):
+            if run is not None:
+                run.sample("cut", ecm_I_mA=cyc.i_mA, note=res.hole.name)
+            if self.on_progress:
+                self.on_progress(res, cyc)
+
+        cyc = cycle.from_params(self.motion, self.pump, self.instr, p, guards=self.guards,
+                                clock=self.now, sleep=self._sleep, on_progress=progress, flow=self.flow)
+        self._feed = cyc.feed_mm_s
+        self._timed(res, "wait", self._wait_primed)
+        if self.recorder is not None:
+            self.recorder.rotate(hole_path(self._record_base, res.hole.name), note=f"batch hole {res.hole.name}")
+        if not self._timed(res, "approach", self._approach):
+            res.fault = "guard tripped during approach"
+            return None
+        if self.recorder is not None:
+            self.recorder.mark_surface()
+        try:
+            res.stats = self._timed(res, "cycle", cyc.run)
+        finally:
+            self.pump.set_duty(BATCH_IDLE_DUTY)
+            if run is not None:
+                run.finish(cycle_s=res.t["cycle"], **(res.stats.as_dict() if res.stats else {}))
+        if res.stats.abort:
+            res.fault = res.stats.abort
+            return None
+        return cyc.retract_mm
+
+    def run(self) -> BatchReport:
+        t_start = self.now()
+        self._arm()
+        setup_s = self.now() - t_start
+        parked = None               # height above the surface after the last hole, None = unknown
+        try:
+            for k, hole in enumerate(self.holes):
+                res = HoleResult(hole)
+                self.results.append(res)
+                if self._fault:
+                    self._clear_estop()
+
+                err = []
+                stop = threading.Event()
+                def background():
+                    try:
+                        self._setup_motion(res, parked, stop)
+                    except Exception as e:
+                        err.append(e)
+                worker = threading.Thread(target=background, name="batch-setup", daemon=True)
+                worker.start()
+                try:
+                    ans = self._timed(res, "operator", self._ask, k, hole)
+                except BaseException:           # Ctrl+C / E-stop at the prompt: don't finish the home/lift
+                    stop.set()
+                    raise
+                finally:
+                    self._timed(res, "wait", worker.join)
+                if err:
+                    res.fault = str(err[0])
+                    self._fault = True
+                    parked = None
+                    print(f"[BATCH] {hole.name}: {res.fault}")
+                    continue
+                parked = BATCH_CLEAR_MM
+                if ans.startswith("q"):
+                    self.results.pop()
+                    raise BatchQuit()
+                if ans.startswith("s"):
+                    res.skipped = True
+                    continue
+
+                print(f"[BATCH] {hole.name}: drilling {hole.params['depth_mm']:.3f} mm")
+                retracted = self._drill(res)
+                self._since_home += 1
+                if retracted is None:
+                    self._fault = True
+                    parked = None
+                    print(f"[BATCH] {hole.name}: fault ({res.fault}) → re-home before next hole")
+                else:
+                    parked = retracted
+            if parked is not None:
+                self._lift(parked)
+        except BatchQuit:
+            print("[BATCH] Stopped by operator.")
+        return BatchReport(self.results, setup_s, self.now() - t_start)
+
+# ---- simulation ----
+class RealtimeClock:
+    """Wall clock running 1/scale × fast. Unlike VirtualClock, sleeps on different
+    threads overlap, so pipelined stages time the same as on the machine.
+    OS sleep overshoot is scaled up by 1/scale too; error_s sums it (machine s)."""
+    def __init__(self, scale: float):
+        self.scale = float(scale)
+        self._t0 = time.monotonic()
+        self.error_s = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def now(self) -> float:
+        return (time.monotonic() - self._t0) / self.scale
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, dt: float):
+        if dt > 0:
+            t0 = time.monotonic()
+            time.sleep(dt * self.scale)
+            over = (time.monotonic() - t0) / self.scale - dt
+            with self._lock:
+                self.error_s += over
+
+def sim_sequencer(holes, operator_s: float = 8.0, time_scale: float = 0.02, clock=None, **kw):
+    """BatchSequencer on replay look-alikes with an operator who takes operator_s per prompt."""
+    from replay import ReplayMotion, ReplayPump, ModelInstrumentation
+    clock = clock or RealtimeClock(time_scale)
+    motion = ReplayMotion(clock)
+    pump = ReplayPump(clock)
+    instr = ModelInstrumentation(motion)
+
+    def operator(text):
+        clock.sleep(operator_s)
+        return ""
+    return BatchSequencer(motion, pump, instr, holes, prompt=operator,
+                          clock=clock.monotonic, sleep=clock.sleep, **kw)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Drill a batch of holes with operator repositioning.")
+    ap.add_argument("holes", nargs="?", default=None, help="JSON list of hole programs")
+    ap.add_argument("--holes", dest="n", type=int, default=1, help="with no file: N config.py holes")
+    ap.add_argument("--depth", type=float, default=TARGET_DEPTH_MM)
+    ap.add_argument("--rehome-every", type=int, default=BATCH_REHOME_EVERY)
+    ap.add_argument("--no-catalog", action="store_true")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    ap.add_argument("--record", default=None, help="record each hole for replay.py (PATH_<hole>.jsonl)")
+    ap.add_argument("--sim", action="store_true", help="simulated machine and operator")
+    ap.add_argument("--operator-s", type=float, default=8.0, help="--sim: operator time per hole")
+    ap.add_argument("--time-scale", type=float, default=0.02,
+                    help="--sim: real s per machine s (smaller → faster, but sleep overshoot inflates times)")
+    a = ap.parse_args(argv)
+
+    holes = (Hole.load(a.holes) if a.holes else
+             [Hole({"depth_mm": a.depth}, k) for k in range(a.n)])
+    print(f"[BATCH] {len(holes)} hole(s), re-home every {a.rehome_every or '∞'}")
+
+    if a.sim:
+        clock = RealtimeClock(a.time_scale)
+        seq = sim_sequencer(holes, a.operator_s, clock=clock, rehome_every=a.rehome_every)
+        rep = seq.run()
+        rep.clock_error_s = clock.error_s
+        print(json.dumps(rep.as_dict(), indent=1) if a.json else rep)
+        return 0
+
+    import RPi.GPIO as GPIO
+    from catalog import Catalog
+    from flow import FlowController, estimator_for
+    from motion import MotionController, Guard
+    from pump import PumpController
+    from safety import SafetyManager
+    from sensors import Instrumentation
+
+    safety = SafetyManager()
+    motion = MotionController()
+    pump   = PumpController()
+    instr  = Instrumentation(use_pump_sensor=True)
+    rec    = None
+    if a.record:
+        rec = Recorder(a.record, note="batch.py setup")
+        motion, pump, instr = rec.wrap(motion, pump, instr)
+    estop  = Guard("estop", safety.estop_active, message="[SAFETY] E-STOP active → stopping.")
+    est     = estimator_for(instr)      # None until `flow.py calibrate` has run
+    catalog = None if a.no_catalog else Catalog()
+    seq = BatchSequencer(motion, pump, instr, holes, safety=safety, guards=(estop,),
+                         rehome_every=a.rehome_every, catalog=catalog,
+                         flow=FlowController(pump, est) if est else None, recorder=rec, make_guard=Guard)
+    try:
+        rep = seq.run()
+        print(json.dumps(rep.as_dict(), indent=1) if a.json else rep)
+    except KeyboardInterrupt:
+        print("\n[SYS] KeyboardInterrupt")
+    finally:
+        pump.off()
+        motion.set_enabled(False)
+        safety.relay_off()
+        if catalog is not None:
+            catalog.close()
+        if rec is not None:
+            rec.close()
+        for c in (motion, pump, instr):
+            c.close()
+        GPIO.cleanup()
+        print("[SYS] Clean exit.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Experiment catalog
+SQLite (stdlib, offline) store with one row per run and an indexed sample
+table. Each run records a config.py snapshot and summary metrics (max/mean
+ECM current, pump duty, feed, cycle time), so questions like "all holes at
+60 % pump duty over 8 A" are an indexed query. Samples are inserted in
+batches in WAL mode; queries return pandas DataFrames.
+
+Usage:
+    python3 catalog.py import data/week4_bringup_log.csv
+    python3 catalog.py runs --where "pump_duty = 60 AND max_I_mA > 8000"
+    python3 catalog.py export 12 run12.csv
+
+    cat = Catalog()
+    run = cat.start_run("drill", note="hole 3", pump_duty=60, feed_mm_s=0.05)
+    run.sample("cut", ecm_V=12.0, ecm_I_mA=850.0)
+    run.finish(cycle_s=41.0)
+    df = cat.runs(pump_duty=60, min_I_mA=8000)
+"""
+import argparse, csv, json, os, re, socket, sqlite3, sys, threading, time
+
+from config import LOG_DIR, LOG_FILE, CATALOG_FILE, CATALOG_BATCH, CATALOG_IMPORT_GAP_S
+from recorder import config_snapshot
+
+SAMPLE_COLS = ("ts", "state", "ecm_V", "ecm_I_mA", "pump_I_mA", "pump_Lmin", "note")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    started     REAL NOT NULL,
+    finished    REAL,
+    machine     TEXT,
+    kind        TEXT,
+    note        TEXT,
+    source      TEXT,
+    config_json TEXT,
+    voltage_V   REAL,
+    feed_mm_s   REAL,
+    pump_duty   REAL,
+    depth_mm    REAL,
+    cycle_s     REAL,
+    n_samples   INTEGER DEFAULT 0,
+    max_I_mA    REAL,
+    mean_I_mA   REAL,
+    max_pump_I_mA REAL,
+    metrics_json TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id    INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    ts        REAL NOT NULL,
+    state     TEXT,
+    ecm_V     REAL,
+    ecm_I_mA  REAL,
+    pump_I_mA REAL,
+    pump_Lmin REAL,
+    note      TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_run_ts ON samples(run_id, ts);
+CREATE INDEX IF NOT EXISTS runs_duty_I    ON runs(pump_duty, max_I_mA);
+CREATE INDEX IF NOT EXISTS runs_max_I     ON runs(max_I_mA);
+CREATE INDEX IF NOT EXISTS runs_started   ON runs(started);
+CREATE UNIQUE INDEX IF NOT EXISTS runs_source ON runs(source, started) WHERE source IS NOT NULL;
+"""
+
+_DUTY_STATE = re.compile(r"pump_duty_(\d+(?:\.\d+)?)$")      # main.py pump-sweep rows
+
+def _num(x):
+    """CSV/None/NaN → float or None (SQL NULL)."""
+    try:
+        v = float(x)
+    except (TypeError, ValueError):
+        return None
+    return None if v != v else v
+
+class Run:
+    """Open run: buffers samples and writes them in batches."""
+    def __init__(self, cat, run_id: int):
+        self.cat = cat
+        self.id = run_id
+        self._buf = []
+        self._lock = threading.Lock()
+
+    def sample(self, state="", ts=None, ecm_V=None, ecm_I_mA=None, pump_I_mA=None,
+               pump_Lmin=None, note=""):
+        row = (self.id, time.time() if ts is None else ts, state, _num(ecm_V), _num(ecm_I_mA),
+               _num(pump_I_mA), _num(pump_Lmin), note)
+        with self._lock:
+            self._buf.append(row)
+            if len(self._buf) >= CATALOG_BATCH:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buf:
+            rows, self._buf = self._buf, []
+            self.cat._insert_samples(rows)
+
+    def finish(self, **metrics):
+        """Flush samples and fill in summary metrics (known keys become columns)."""
+        self.flush()
+        self.cat._finish_run(self.id, metrics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+class Catalog:
+    RUN_COLS = ("voltage_V", "feed_mm_s", "pump_duty", "depth_mm", "cycle_s")
+
+    def __init__(self, path: str = None):
+        path = path or os.path.join(LOG_DIR, CATALOG_FILE)
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    # ---- writing ----
+    def start_run(self, kind: str, note: str = "", source: str = None, started: float = None,
+                  config: dict = None, **params) -> Run:
+        cols = {k: _num(params[k]) for k in self.RUN_COLS if k in params}
+        row = {"started": time.time() if started is None else started,
+               "machine": socket.gethostname(), "kind": kind, "note": note, "source": source,
+               "config_json": json.dumps(config_snapshot() if config is None else config), **cols}
+        keys = ",".join(row)
+        marks = ",".join("?" * len(row))
+        with self._lock, self.db:
+            cur = self.db.execute(f"INSERT INTO runs ({keys}) VALUES ({marks})", tuple(row.values()))
+        return Run(self, cur.lastrowid)
+
+    def _insert_samples(self, rows):
+        with self._lock, self.db:
+            self.db.executemany("INSERT INTO samples VALUES (?,?,?,?,?,?,?,?)", rows)
+
+    def _finish_run(self, run_id: int, metrics: dict):
+        cols = {k: _num(metrics.pop(k)) for k in self.RUN_COLS if k in metrics}
+        finished = metrics.pop("finished", None)
+        with self._lock, self.db:
+            agg = self.db.execute(
+                "SELECT COUNT(*), MAX(ecm_I_mA), AVG(ecm_I_mA), MAX(pump_I_mA), MAX(ts) "
+                "FROM samples WHERE run_id = ?", (run_id,)).fetchone()
+            sets = {"finished": finished or agg[4] or time.time(), "n_samples": agg[0],
+                    "max_I_mA": agg[1], "mean_I_mA": agg[2], "max_pump_I_mA": agg[3],
+                    "metrics_json": json.dumps(metrics) if metrics else None, **cols}
+            assign = ",".join(f"{k} = ?" for k in sets)
+            self.db.execute(f"UPDATE runs SET {assign} WHERE id = ?", (*sets.values(), run_id))
+
+    # ---- import ----
+    def import_csv(self, path: str = None, gap_s: float = CATALOG_IMPORT_GAP_S) -> list:
+        """Import a bring-up CSV log (main.py format). A gap longer than gap_s
+        between rows starts a new run. Already-imported runs are skipped.
+        Duties from pump_duty_NN states go to metrics["pump_duties"]; the
+        run's pump_duty is the highest of them."""
+        path = path or os.path.join(LOG_DIR, LOG_FILE)
+        src = os.path.abspath(path)
+        with open(path, newline="") as f:
+            rows = [r for r in csv.DictReader(f) if _num(r.get("ts")) is not None]
+        rows.sort(key=lambda r: float(r["ts"]))
+        groups, cur, last = [], [], None
+        for r in rows:
+            ts = float(r["ts"])
+            if cur and ts - last > gap_s:
+                groups.append(cur)
+                cur = []
+            cur.append(r)
+            last = ts
+        if cur:
+            groups.append(cur)
+
+        ids = []
+        for g in groups:
+            t0 = float(g[0]["ts"])
+            with self._lock:
+                seen = self.db.execute("SELECT id FROM runs WHERE source = ? AND started = ?",
+                                       (src, t0)).fetchone()
+            if seen:
+                continue
+            duties = sorted({float(m.group(1)) for m in
+                             (_DUTY_STATE.match(r.get("state") or "") for r in g) if m})
+            extra = {"pump_duty": duties[-1]} if duties else {}
+            run = self.start_run("import", note=os.path.basename(path), source=src,
+                                 started=t0, config={}, **extra)
+            for r in g:
+                run.sample(ts=float(r["ts"]), **{k: r.get(k) for k in SAMPLE_COLS if k != "ts"})
+            run.finish(finished=float(g[-1]["ts"]), **({"pump_duties": duties} if duties else {}))
+            ids.append(run.id)
+        return ids
+
+    # ---- queries ----
+    def query(self, sql: str, params=()):
+        """Arbitrary SELECT → pandas DataFrame."""
+        import pandas as pd
+        with self._lock:
+            return pd.read_sql_query(sql, self.db, params=params)
+
+    def runs(self, pump_duty=None, min_I_mA=None, kind=None, since=None, where=None, params=()):
+        """Runs matching the filters, newest first."""
+        clauses, args = [], []
+        if pump_duty is not None:
+            clauses.append("pump_duty = ?"); args.append(pump_duty)
+        if min_I_mA is not None:
+            clauses.append("max_I_mA > ?"); args.append(min_I_mA)
+        if kind is not None:
+            clauses.append("kind = ?"); args.append(kind)
+        if since is not None:
+            clauses.append("started >= ?"); args.append(since)
+        if where:
+            clauses.append(f"({where})"); args.extend(params)
+        sql = ("SELECT id, started, finished, machine, kind, note, voltage_V, feed_mm_s, pump_duty, "
+               "depth_mm, cycle_s, n_samples, max_I_mA, mean_I_mA, max_pump_I_mA FROM runs")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return self.query(sql + " ORDER BY started DESC", args)
+
+    def samples(self, run_id: int):
+        return self.query("SELECT " + ",".join(SAMPLE_COLS) + " FROM samples WHERE run_id = ? ORDER BY ts",
+                          (run_id,))
+
+    def run_config(self, run_id: int) -> dict:
+        with self._lock:
+            row = self.db.execute("SELECT config_json FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def export_csv(self, run_id: int, path: str) -> int:
+        with self._lock:
+            rows = self.db.execute("SELECT " + ",".join(SAMPLE_COLS) + " FROM samples "
+                                   "WHERE run_id = ? ORDER BY ts", (run_id,)).fetchall()
+        with open(path, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(SAMPLE_COLS)
+            w.writerows(rows)
+        return len(rows)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ECM experiment catalog.")
+    ap.add_argument("--db", default=None)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import");  p.add_argument("csv", nargs="?", default=None)
+    p = sub.add_parser("runs");    p.add_argument("--where", default=None)
+    p = sub.add_parser("export");  p.add_argument("run_id", type=int); p.add_argument("out")
+    a = ap.parse_args(argv)
+
+    cat = Catalog(a.db)
+    if a.cmd == "import":
+        ids = cat.import_csv(a.csv)
+        print(f"[CATALOG] imported {len(ids)} run(s): {ids}")
+    elif a.cmd == "runs":
+        print(cat.runs(where=a.where).to_string(index=False))
+    elif a.cmd == "export":
+        n = cat.export_csv(a.run_id, a.out)
+        print(f"[CATALOG] wrote {n} samples to {a.out}")
+    cat.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -27,33 +27,28 @@ PUMP_PWM_HZ     = 1000         # 1 kHz PWM for MOSFET
 PUMP_DUTY_IDLE  = 0
 PUMP_DUTY_RUN   = 60           # starting point; tune on bench
 
-# ---- INA219 addresses (set by A0/A1 solder pads on modules) ----
-INA_ECM_ADDR    = 0x40   # ECM loop shunt
-INA_PUMP_ADDR   = 0x41   # pump branch shunt (optional)
-
 # ---- Logging ----
 LOG_DIR         = "data"
-LOG_FILE        = "week4_bringup_log.csv"
+LOG_FILE        = "week4_bringup_log.csv"   # legacy CSV; runs now go to the catalog (catalog.py import)
 
 # ---- Debounce / timing ----
 DEBOUNCE_MS     = 20
 SAFETY_POLL_MS  = 10
 
-# ---- Shunt info (for notes; INA219 handles internally via library) ----
-ECM_SHUNT_OHMS  = 0.01   # 10× 0.1Ω // parallel
-PUMP_SHUNT_OHMS = 0.01
-
 # ---- Homing ----
 HOME_DIR_UP     = True   # True → set DIR to move toward TOP limit
 HOME_FEED_MM_S  = 0.5
 HOME_BACKOFF_MM = 0.5
+HOME_SEEK_FEED_MM_S = 0.3125   # approach to the limit switch (500 steps/s at 1600 steps/mm)
+HOME_SLOW_FEED_MM_S = 0.15625  # slow re-approach after the backoff (250 steps/s)
 
 # ---- INA219 per-channel config ----
-INA_ECM_ADDR       = 0x40
-INA_PUMP_ADDR      = 0x41  # wire later if needed
+# addresses set by A0/A1 solder pads on the modules
+INA_ECM_ADDR       = 0x40  # ECM loop shunt
+INA_PUMP_ADDR      = 0x41  # pump branch shunt (optional)
 
-# Your physical shunts (Ω)
-ECM_SHUNT_OHMS     = 0.010
+# Your physical shunts (Ω); INA219 lib assumes 0.1Ω, sensors.py rescales
+ECM_SHUNT_OHMS     = 0.010  # 10× 0.1Ω // parallel
 PUMP_SHUNT_OHMS    = 0.010
 
 # If wiring makes current negative, flip here
@@ -67,7 +62,7 @@ PUMP_I_OFFSET_MA   = 0.0
 # Tiny smoothing for display/logs (0 = off, 0.1 = gentle)
 CURRENT_EMA_ALPHA  = 0.15
 
-# ---- ECM material constants for MRR ----
+# ---- ECM material constants for MRR (the "al6061" profile; see profiles.py) ----
 ATOMIC_WEIGHT_KG_PER_MOL = 0.02698   # Aluminum
 VALENCE_Z                 = 3
 DENSITY_KG_PER_M3         = 2700.0
@@ -83,3 +78,83 @@ K_MM3_PER_COULOMB = (
 TOOL_DIAMETER_MM = 1.00
 OVERCUT_MM       = 0.00
 TARGET_DEPTH_MM  = 2.00
+
+# ---- Replay (replay.py) ----
+REPLAY_CONTACT_FRAC = 0.10    # no surface mark: first sample above this × peak ECM current is contact
+
+# ---- ECM process model (ecm_sim.py) ----
+ECM_VOLTAGE_V              = 12.0    # gap supply setpoint
+ECM_FEED_MM_S              = 0.05    # cutting feed; tune on bench or via ecm_sim
+PSU_MAX_V                  = 30.0
+PSU_MAX_A                  = 10.0
+ELECTROLYTE_S_PER_M        = 12.0    # ~10 % NaCl at 25 °C
+ELECTROLYTE_TEMP_COEFF     = 0.02    # fractional conductivity rise per K
+ELECTRODE_OVERPOTENTIAL_V  = 2.0     # anode + cathode drop, not available to the gap
+MIN_GAP_MM                 = 0.02    # below this sludge/roughness bridges the gap
+VOID_FRACTION_CRIT         = 0.5     # H2 void fraction where sparking sets in
+PUMP_MAX_LMIN              = 1.5     # pump flow at 100 % duty (estimate)
+GAP_FLOW_FRACTION          = 0.10    # share of pump flow that actually passes the gap (through-tool flush)
+
+# ---- Loop-timing tracer (looptrace.py) ----
+TRACE_ENABLED       = False   # or ECM_TRACE=1 / SIGUSR1 at runtime
+TRACE_BUFFER_EVENTS = 65536   # per-thread ring buffer size
+
+# ---- Peck / periodic-retract cycle (cycle.py) ----
+PECK_CHUNK_MM       = 0.02    # feed increment between trigger checks
+PECK_RETRACT_MM     = 0.30    # lift per peck
+PECK_CLEARANCE_MM   = 0.02    # rapid-return stops this far above last depth
+PECK_DWELL_S        = 0.5     # flush dwell at the top of a peck
+PECK_BOOST_DUTY     = 100     # pump duty during the dwell
+PECK_RAPID_MM_S     = 2.0     # retract / return speed
+PECK_EVERY_S        = 10.0    # time trigger (0 = off)
+PECK_EVERY_MM       = 0.25    # depth trigger (0 = off)
+PECK_I_DROP_FRAC    = 0.20    # current trigger: fall below (1 − this) × post-peck baseline (0 = off)
+PECK_I_SHORT_MA     = 9000.0  # retract immediately above this ECM current
+
+# ---- Job server / fleet (jobserver.py, fleet.py) ----
+JOB_SERVER_PORT     = 8750
+JOB_MAX_DEPTH_MM    = 5.0     # reject jobs deeper than the Z stroke allows
+JOB_DIAMETER_TOL_MM = 0.05    # job diameter must match TOOL_DIAMETER_MM within this
+JOB_MAX_DWELL_S     = 60.0    # longest peck dwell a job may ask for
+FLEET_MAX_QUEUED    = 2       # jobs the coordinator keeps queued per machine
+FLEET_POLL_S        = 0.5
+
+# ---- I2C bus scheduler (i2cbus.py) ----
+I2C_ECM_HZ          = 200     # ECM INA219 sample rate (high priority)
+I2C_PUMP_HZ         = 10      # pump INA219 / housekeeping rate (low priority)
+I2C_RETRIES         = 2       # per transaction, after the first attempt
+I2C_RECOVER_AFTER   = 5       # consecutive failed samples before re-opening the bus
+I2C_STALE_S         = 0.5     # cached sample older than this reads as NaN
+
+# ---- Experiment catalog (catalog.py) ----
+CATALOG_FILE        = "catalog.sqlite"   # in LOG_DIR
+CATALOG_BATCH       = 200                # samples buffered per INSERT transaction
+CATALOG_IMPORT_GAP_S = 300.0             # CSV import: a gap this long starts a new run
+
+# ---- Flow estimate / closed-loop pump (flow.py) ----
+PUMP_ID             = "pump0"    # calibration is stored per pump: LOG_DIR/flow_<PUMP_ID>.json
+FLOW_TARGET_LMIN    = 0.6        # flushing flow to hold
+FLOW_CAL_DUTIES     = (30, 40, 50, 60, 70, 80, 90, 100)
+FLOW_CAL_SETTLE_S   = 3.0
+FLOW_DRY_FRAC       = 0.40       # dry-run current / calibrated current (zero flow; at or below → dry run)
+FLOW_CTRL_HZ        = 10
+FLOW_KP             = 20.0       # % duty per L/min error
+FLOW_KI             = 10.0       # % duty per L/min·s
+FLOW_RAMP_PCT_S     = 20.0       # soft ramp: max duty change per second
+FLOW_DUTY_MIN       = 20
+FLOW_DUTY_MAX       = 100
+FLOW_CLOG_RATIO     = 0.70       # current / calibrated current below this → clog
+FLOW_FAULT_HOLD_S   = 2.0        # condition must persist this long
+
+# ---- Multi-hole batch sequencer (batch.py) ----
+BATCH_SURFACE_MM    = 10.0    # home (top limit) down to the work surface
+BATCH_CLEAR_MM      = 3.0     # tool waits this far above the surface while the part is repositioned
+BATCH_REHOME_EVERY  = 10      # re-home every N holes (0 = only at start and after a fault)
+BATCH_IDLE_DUTY     = 30      # pump duty between holes (keeps the circuit primed)
+BATCH_PRIME_S       = 3.0     # minimum pump run before the first hole
+
+# ---- Machine / material profiles (profiles.py) ----
+MACHINE_PROFILE     = "bench"        # built from the values above
+MATERIAL            = "al6061"       # al6061 | steel | … (profiles.py, PROFILE_FILE)
+PROFILE_FILE        = "profiles.json"   # extra/overriding profiles, next to config.py (optional)
+FEED_RES_MM_S       = 0.001          # step timing table resolution
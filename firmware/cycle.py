@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Peck drilling cycle
+Feeds to TARGET_DEPTH_MM in small increments and periodically retracts to
+flush sludge and hydrogen out of the gap: lift PECK_RETRACT_MM, dwell with
+the pump boosted, rapid back to just above the last depth, then resume the
+cutting feed. Retracts are triggered by elapsed time, depth fed, or ECM
+current degradation (any trigger fires a peck). Reports how the cycle time
+split between cutting and retracting.
+
+With a FlowController (flow.py, needs a pump calibration) the controller
+owns pump duty while cutting, holding the target flush flow; the boost dwell
+takes the pump over briefly and a dry-run fault aborts the cycle. Without
+one the pump runs at the fixed run/boost duties.
+
+Works with the real controllers or the replay look-alikes (pass the virtual
+clock's monotonic/sleep). Assumes the tool starts at the work surface.
+
+Usage:
+    python3 cycle.py                                # drill one hole with config.py settings
+    python3 cycle.py --record data/hole_01.jsonl    # … and record it for replay.py
+"""
+import sys, time
+
+from config import (TARGET_DEPTH_MM, TOOL_DIAMETER_MM, OVERCUT_MM,
+                    ECM_FEED_MM_S, PUMP_DUTY_RUN,
+                    PECK_CHUNK_MM, PECK_RETRACT_MM, PECK_CLEARANCE_MM, PECK_DWELL_S,
+                    PECK_BOOST_DUTY, PECK_RAPID_MM_S, PECK_EVERY_S, PECK_EVERY_MM,
+                    PECK_I_DROP_FRAC, PECK_I_SHORT_MA)
+
+# ---- retract triggers ----
+class TimeTrigger:
+    """Peck every `interval_s` of cutting."""
+    def __init__(self, interval_s: float):
+        self.interval_s = float(interval_s)
+    def reset(self, cyc):
+        self._t0 = cyc.now()
+    def due(self, cyc):
+        return cyc.now() - self._t0 >= self.interval_s and f"time {self.interval_s:g}s"
+
+class DepthTrigger:
+    """Peck every `every_mm` of depth fed."""
+    def __init__(self, every_mm: float):
+        self.every_mm = float(every_mm)
+    def reset(self, cyc):
+        self._d0 = cyc.depth_mm
+    def due(self, cyc):
+        return cyc.depth_mm - self._d0 >= self.every_mm - 1e-9 and f"depth {self.every_mm:g}mm"
+
+class CurrentTrigger:
+    """
+    Peck when ECM current falls `drop_frac` below the baseline seen right
+    after the last peck (gas/sludge lowering gap conductivity), or rises past
+    `short_mA` (incipient short).
+    """
+    def __init__(self, drop_frac: float, short_mA: float = PECK_I_SHORT_MA, settle: int = 3):
+        self.drop_frac = float(drop_frac)
+        self.short_mA = float(short_mA)
+        self.settle = int(settle)
+    def reset(self, cyc):
+        self._base = 0.0
+        self._n = 0
+    def due(self, cyc):
+        i = cyc.i_mA
+        if i != i:          # NaN sample → no decision
+            return False
+        if i > self.short_mA:
+            return f"short {i:.0f}mA"
+        if self._n < self.settle:
+            self._base = max(self._base, i)
+            self._n += 1
+            return False
+        if self.drop_frac > 0 and self._base > 0 and i < self._base * (1.0 - self.drop_frac):
+            return f"current drop {i:.0f}/{self._base:.0f}mA"
+        return False
+
+def default_triggers():
+    t = []
+    if PECK_EVERY_S > 0:
+        t.append(TimeTrigger(PECK_EVERY_S))
+    if PECK_EVERY_MM > 0:
+        t.append(DepthTrigger(PECK_EVERY_MM))
+    t.append(CurrentTrigger(PECK_I_DROP_FRAC))
+    return t
+
+# ---- cycle ----
+class CycleStats:
+    PHASES = ("cut", "retract", "dwell", "return", "reapproach")
+
+    def __init__(self, tool_diameter_mm: float = TOOL_DIAMETER_MM):
+        self.hole_d_mm = tool_diameter_mm + 2.0 * OVERCUT_MM     # for MRR
+        self.t = {p: 0.0 for p in self.PHASES}
+        self.pecks = 0
+        self.reasons = []
+        self.depth_mm = 0.0
+        self.complete = False
+        self.abort = None
+        self.withdrawn = False          # tool back above the surface after the cycle
+
+    @property
+    def total_s(self) -> float:
+        return sum(self.t.values())
+
+    def as_dict(self) -> dict:
+        tot = self.total_s
+        vol = 0.25 * 3.141592653589793 * self.hole_d_mm ** 2 * self.depth_mm
+        d = {f"{p}_s": round(v, 3) for p, v in self.t.items()}
+        d.update({
+            "total_s": round(tot, 3),
+            "cut_frac": round(self.t["cut"] / tot, 4) if tot else 0.0,
+            "pecks": self.pecks,
+            "depth_mm": round(self.depth_mm, 4),
+            "mrr_mm3_s": round(vol / tot, 5) if tot else 0.0,
+            "complete": self.complete,
+            "abort": self.abort,
+        })
+        return d
+
+    def __str__(self):
+        d = self.as_dict()
+        tot = d["total_s"] or 1.0
+        parts = "  ".join(f"{p}={self.t[p]:.1f}s({100*self.t[p]/tot:.0f}%)" for p in self.PHASES)
+        return (f"[CYCLE] depth={d['depth_mm']:.3f}mm  total={d['total_s']:.1f}s  pecks={d['pecks']}  "
+                f"MRR={d['mrr_mm3_s']:.4f}mm³/s\n[CYCLE] {parts}")
+
+class PeckCycle:
+    def __init__(self, motion, pump, instr=None, triggers=None,
+                 depth_mm=TARGET_DEPTH_MM, feed_mm_s=ECM_FEED_MM_S, chunk_mm=PECK_CHUNK_MM,
+                 retract_mm=PECK_RETRACT_MM, clearance_mm=PECK_CLEARANCE_MM,
+                 dwell_s=PECK_DWELL_S, boost_duty=PECK_BOOST_DUTY, run_duty=PUMP_DUTY_RUN,
+                 rapid_mm_s=PECK_RAPID_MM_S, guards=(), clock=time.monotonic, sleep=time.sleep,
+                 on_progress=None, flow=None, withdraw_guards=None):
+        self.motion = motion
+        self.pump = pump
+        self.flow = flow                    # FlowController or None (fixed duties)
+        self.instr = instr
+        self.triggers = default_triggers() if triggers is None else list(triggers)
+        self.target_mm = float(depth_mm)
+        self.feed_mm_s = float(feed_mm_s)
+        self.chunk_mm = float(chunk_mm)
+        self.retract_mm = float(retract_mm)
+        self.clearance_mm = min(float(clearance_mm), self.retract_mm)
+        self.dwell_s = float(dwell_s)
+        self.boost_duty = boost_duty
+        self.run_duty = run_duty
+        self.rapid_mm_s = float(rapid_mm_s)
+        self.guards = tuple(guards)
+        # final withdraw: defaults to the cut guards; pass e.g. estop only so a cancel still withdraws
+        self.withdraw_guards = self.guards if withdraw_guards is None else tuple(withdraw_guards)
+        self.now = clock
+        self._sleep = sleep
+        self.on_progress = on_progress      # called as on_progress(cycle) after each cut chunk
+        self.depth_mm = 0.0
+        self.i_mA = float("nan")
+        self.stats = CycleStats(motion.profile.machine.tool_diameter_mm)
+        self._z_steps = 0       # commanded position in whole steps, +up, 0 = work surface
+
+    def _move_to(self, z_mm, feed, phase, guards=None) -> bool:
+        """
+        Timed move to z_mm (relative to the surface, +up); False if a guard
+        stopped it short. Each move is target steps minus current steps, so
+        truncation can't accumulate over retract/return pairs.
+        """
+        spm = self.motion.profile.steps_per_mm
+        delta = int(round(z_mm * spm)) - self._z_steps
+        if delta == 0:
+            return True
+        t0 = self.now()
+        # half-step pad so profile.steps() truncates to exactly |delta|
+        moved = self.motion.move_mm((delta + (0.5 if delta > 0 else -0.5)) / spm, feed,
+                                    self.guards if guards is None else guards)
+        self.stats.t[phase] += self.now() - t0
+        n = abs(delta) if moved is None else min(int(moved), abs(delta))
+        self._z_steps += n if delta > 0 else -n
+        return n >= abs(delta)
+
+    def _sample(self):
+        if self.instr is not None:
+            self.i_mA = float(self.instr.snapshot().get("ecm_I_mA", float("nan")))
+
+    def _reset_triggers(self):
+        for t in self.triggers:
+            t.reset(self)
+
+    def peck(self, reason=""):
+        """Retract, dwell with boosted flow, rapid back to just above the last depth, re-approach."""
+        st = self.stats
+        if self.flow is not None and self.flow.state == "dry":
+            return True                     # keep the latch: _cut aborts on its next pass
+        st.pecks += 1
+        st.reasons.append(reason)
+        if not self._move_to(self.retract_mm - self.depth_mm, self.rapid_mm_s, "retract"):
+            return False
+        t0 = self.now()
+        if self.flow is not None:
+            self.flow.hold(self.boost_duty)     # boost overrides the loop for the dwell
+            self._sleep(self.dwell_s)
+            self.flow.hold(None)
+        else:
+            self.pump.set_duty(self.boost_duty)
+            self._sleep(self.dwell_s)
+            self.pump.set_duty(self.run_duty)
+        st.t["dwell"] += self.now() - t0
+        if not self._move_to(self.clearance_mm - self.depth_mm, self.rapid_mm_s, "return"):
+            return False
+        if not self._move_to(-self.depth_mm, self.feed_mm_s, "reapproach"):
+            return False
+        self._reset_triggers()
+        return True
+
+    def run(self) -> CycleStats:
+        st = self.stats
+        self.pump.set_duty(self.run_duty)
+        if self.flow is not None:
+            self.flow.start()               # ramps from run_duty to the target flow
+        try:
+            self._cut(st)
+        finally:
+            if self.flow is not None:
+                self.flow.stop(pump_off=False)
+        st.depth_mm = self.depth_mm
+        st.complete = st.abort is None and self.depth_mm >= self.target_mm - 1e-9
+        # withdraw clear of the hole
+        st.withdrawn = self._move_to(self.retract_mm, self.rapid_mm_s, "retract", self.withdraw_guards)
+        return st
+
+    def _cut(self, st):
+        self.motion.set_enabled(True)
+        self._reset_triggers()
+        while self.depth_mm < self.target_mm - 1e-9:
+            if self.flow is not None and self.flow.state == "dry":
+                st.abort = "pump running dry"
+                break
+            chunk = min(self.chunk_mm, self.target_mm - self.depth_mm)
+            if not self._move_to(-(self.depth_mm + chunk), self.feed_mm_s, "cut"):
+                st.abort = "guard tripped during cut"
+                break
+            self.depth_mm += chunk
+            self._sample()
+            if self.on_progress:
+                self.on_progress(self)
+            reason = next((r for r in (t.due(self) for t in self.triggers) if r), None)
+            if reason and self.depth_mm < self.target_mm - 1e-9:
+                if not self.peck(reason):
+                    st.abort = "guard tripped during peck"
+                    break
+
+def from_params(motion, pump, instr, params, **kw):
+    """Build a PeckCycle from a flat params dict (replay sweeps, job server)."""
+    trig = []
+    if params.get("every_s", PECK_EVERY_S) > 0:
+        trig.append(TimeTrigger(params.get("every_s", PECK_EVERY_S)))
+    if params.get("every_mm", PECK_EVERY_MM) > 0:
+        trig.append(DepthTrigger(params.get("every_mm", PECK_EVERY_MM)))
+    trig.append(CurrentTrigger(params.get("i_drop_frac", PECK_I_DROP_FRAC),
+                               params.get("i_short_mA", PECK_I_SHORT_MA)))
+    return PeckCycle(motion, pump, instr, triggers=trig,
+                     depth_mm=params.get("depth_mm", TARGET_DEPTH_MM),
+                     feed_mm_s=params.get("feed_mm_s", ECM_FEED_MM_S),
+                     chunk_mm=params.get("chunk_mm", PECK_CHUNK_MM),
+                     retract_mm=params.get("retract_mm", PECK_RETRACT_MM),
+                     dwell_s=params.get("dwell_s", PECK_DWELL_S),
+                     run_duty=params.get("pump_duty", PUMP_DUTY_RUN),
+                     boost_duty=params.get("boost_duty", PECK_BOOST_DUTY),
+                     **kw)
+
+def peck_program(motion, pump, instr, clock, params):
+    """replay.py program: one peck cycle driven by params."""
+    cyc = from_params(motion, pump, instr, params, clock=clock.monotonic, sleep=clock.sleep)
+    d = cyc.run().as_dict()
+    d["shorts"] = sum(1 for r in cyc.stats.reasons if r.startswith("short"))
+    pump.off()
+    return d
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Peck-drill one hole with config.py settings.")
+    ap.add_argument("--record", default=None, help="record the run for replay.py (JSON lines)")
+    a = ap.parse_args(argv)
+
+    import RPi.GPIO as GPIO
+    from flow import FlowController, estimator_for
+    from motion import MotionController, Guard
+    from pump import PumpController
+    from safety import SafetyManager
+    from sensors import Instrumentation
+
+    safety = SafetyManager()
+    motion = MotionController()
+    pump   = PumpController()
+    instr  = Instrumentation(use_pump_sensor=True)
+    rec    = None
+    if a.record:
+        from recorder import Recorder
+        rec = Recorder(a.record, note="cycle.py")
+        motion, pump, instr = rec.wrap(motion, pump, instr)
+        rec.mark_surface()              # the cycle starts with the tool at the surface
+    estop  = Guard("estop", safety.estop_active, message="[SAFETY] E-STOP active → stopping.")
+    est    = estimator_for(instr)       # None until `flow.py calibrate` has run
+    flow   = FlowController(pump, est) if est else None
+
+    print(f"[CYCLE] Peck drilling {TARGET_DEPTH_MM:.2f} mm @ {ECM_FEED_MM_S:.3f} mm/s")
+    safety.relay_on()
+    try:
+        stats = PeckCycle(motion, pump, instr, guards=(estop,), flow=flow).run()
+        print(stats)
+        if stats.abort:
+            print(f"[CYCLE] Aborted: {stats.abort}")
+    except KeyboardInterrupt:
+        print("\n[SYS] KeyboardInterrupt")
+    finally:
+        pump.off()
+        motion.set_enabled(False)
+        safety.relay_off()
+        GPIO.cleanup()
+        if rec is not None:
+            rec.close()
+        for c in (motion, pump, instr):
+            c.close()
+        print("[SYS] Clean exit.")
+
+if __name__ == "__main__":
+    sys.exit(main())
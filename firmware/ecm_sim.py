@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Vectorized process simulator
+Equilibrium-gap model of ECM drilling, evaluated with NumPy over a whole grid
+of (voltage, feed, pump duty) combinations at once and sharded across
+cores. Predicts cycle time, side overcut and short risk, and writes the
+fastest safe settings that hit the configured OVERCUT_MM (or, if the model
+says it cannot be reached, come closest to it) back in config.py format. If
+nothing is under RISK_MAX it falls back to the lowest-risk setting with a
+warning (and will not --apply it).
+Feeds are limited to the [MIN_FEED_MM_S, MAX_FEED_MM_S] range the machine runs.
+
+Model (per combination, all closed form):
+  I      = f·A / K                  Faraday removal at equilibrium (K = K_MM3_PER_COULOMB)
+  α      = Qg / (Qg + Ql)           H2 void fraction in the gap (Qg from I, Ql from pump duty)
+  κ_eff  = κ(T)·(1 − α)^1.5         Bruggeman correction for gas bubbles
+  h_e    = κ_eff·(V − ΔV)·K / f     equilibrium frontal gap
+  h_s    = √(h_e² + 2·h_e·L)        side gap of a bare tool after depth L
+  risk   = 1 − Π(1 − r_i)           gap collapse, void fraction, PSU current ceiling
+
+Usage:
+    python3 ecm_sim.py                     # default grid, print top settings
+    python3 ecm_sim.py --overcut 0.3       # rank against another overcut target
+    python3 ecm_sim.py --out data/recommended_config.py
+    python3 ecm_sim.py --apply             # rewrite the values in config.py
+    python3 ecm_sim.py --check             # exit 1 if the default sweep has no safe setting
+"""
+import argparse, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+from config import (K_MM3_PER_COULOMB, FARADAY_C_PER_MOL, TOOL_DIAMETER_MM, OVERCUT_MM,
+                    TARGET_DEPTH_MM, MIN_FEED_MM_S, MAX_FEED_MM_S,
+                    PSU_MAX_V, PSU_MAX_A, ELECTROLYTE_S_PER_M, ELECTROLYTE_TEMP_COEFF,
+                    ELECTRODE_OVERPOTENTIAL_V, MIN_GAP_MM, VOID_FRACTION_CRIT,
+                    PUMP_MAX_LMIN, GAP_FLOW_FRACTION)
+
+H2_L_PER_MOL   = 24.5        # molar gas volume at ~25 °C
+WATER_J_PER_L_K = 4.18e3     # volumetric heat capacity of the electrolyte
+RISK_MAX       = 0.05        # acceptable short risk for a recommendation
+OVERCUT_TOL_MM = 0.02        # |predicted − target| allowed
+
+def simulate(V, f, duty, overcut, depth_mm=TARGET_DEPTH_MM, tool_d_mm=TOOL_DIAMETER_MM,
+             K=K_MM3_PER_COULOMB):
+    """Evaluate arrays (broadcastable) of voltage [V], feed [mm/s], pump duty [%]
+    and overcut target [mm]; K is the material's mm³/C. Returns a dict of arrays."""
+    V = np.asarray(V, dtype=float)
+    f = np.clip(np.asarray(f, dtype=float), 1e-6, None)
+    duty = np.asarray(duty, dtype=float)
+    overcut = np.asarray(overcut, dtype=float)
+    V, f, duty, overcut = np.broadcast_arrays(V, f, duty, overcut)
+
+    area_mm2 = 0.25 * np.pi * tool_d_mm ** 2
+    I = f * area_mm2 / K                                   # A
+
+    # flushing: pump flow through the gap, H2 evolution at the cathode
+    q_liq = PUMP_MAX_LMIN * np.clip(duty, 0.0, 100.0) / 100.0 * GAP_FLOW_FRACTION / 60.0  # L/s
+    q_gas = I / (2.0 * FARADAY_C_PER_MOL) * H2_L_PER_MOL                                  # L/s
+    alpha = q_gas / np.maximum(q_gas + q_liq, 1e-12)
+
+    # Joule heating of the gap flow raises conductivity
+    dT = np.where(q_liq > 0, I * V / (WATER_J_PER_L_K * np.maximum(q_liq, 1e-12)), 100.0)
+    dT = np.minimum(dT, 60.0)
+    kappa = ELECTROLYTE_S_PER_M * 1e-3 * (1.0 + ELECTROLYTE_TEMP_COEFF * dT)   # S/mm
+    kappa_eff = kappa * (1.0 - alpha) ** 1.5
+
+    v_gap = np.maximum(V - ELECTRODE_OVERPOTENTIAL_V, 0.0)
+    h_e = kappa_eff * v_gap * K / f                        # mm
+    h_s = np.sqrt(h_e ** 2 + 2.0 * h_e * depth_mm)          # mm, radial
+
+    r_gap = 1.0 / (1.0 + np.exp((h_e - MIN_GAP_MM) / (0.25 * MIN_GAP_MM)))
+    r_void = np.clip(alpha / VOID_FRACTION_CRIT, 0.0, 1.0) ** 2
+    r_psu = ((I > PSU_MAX_A) | (V > PSU_MAX_V)).astype(float)
+    risk = 1.0 - (1.0 - r_gap) * (1.0 - r_void) * (1.0 - r_psu)
+
+    cycle_s = depth_mm / f
+    safe = (v_gap > 0) & (risk <= RISK_MAX)
+    err = np.abs(h_s - overcut)
+    return {
+        "voltage_V": V, "feed_mm_s": f, "pump_duty": duty, "overcut_target_mm": overcut,
+        "current_A": I, "void_fraction": alpha, "gap_mm": h_e, "overcut_mm": h_s,
+        "short_risk": risk, "cycle_s": cycle_s, "overcut_err_mm": err,
+        "safe": safe, "feasible": safe & (err <= OVERCUT_TOL_MM),
+    }
+
+def _simulate_shard(shard):
+    V, f, duty, overcut, K = shard
+    return simulate(V, f, duty, overcut, K=K)
+
+def sweep(voltages, feeds, duties, overcuts=(OVERCUT_MM,), workers=None, K=K_MM3_PER_COULOMB):
+    """Full-factorial sweep; the flattened grid is split into one shard per worker.
+    Feeds are clipped to the machine's range (MotionController would clamp them anyway)."""
+    feeds = np.unique(np.clip(np.asarray(feeds, float), MIN_FEED_MM_S, MAX_FEED_MM_S))
+    grids = np.meshgrid(np.asarray(voltages, float), feeds,
+                        np.asarray(duties, float), np.asarray(overcuts, float), indexing="ij")
+    flat = [g.ravel() for g in grids]
+    n = flat[0].size
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or n < 10000:
+        return simulate(*flat, K=K)
+    idx = np.array_split(np.arange(n), workers)
+    shards = [tuple(a[i] for a in flat) + (K,) for i in idx]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        parts = list(ex.map(_simulate_shard, shards))
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+def rank(res, top=10):
+    """Indices of the fastest safe settings on the overcut target (ties → lower risk).
+    If no safe setting is within OVERCUT_TOL_MM of the target, the band is taken
+    around the closest safe overcut instead; check res["feasible"] for which case.
+    With no safe setting at all, the lowest-risk ones; check res["safe"]."""
+    ok = np.flatnonzero(res["safe"])
+    if ok.size == 0:
+        return np.argsort(res["short_risk"], kind="stable")[:top]
+    err = res["overcut_err_mm"][ok]
+    ok = ok[err <= max(err.min(), 0.0) + OVERCUT_TOL_MM]
+    order = np.lexsort((res["short_risk"][ok], res["cycle_s"][ok]))
+    return ok[order[:top]]
+
+# ---- write back ----
+def recommended(res, i):
+    return {
+        "ECM_VOLTAGE_V": round(float(res["voltage_V"][i]), 2),
+        "ECM_FEED_MM_S": round(float(res["feed_mm_s"][i]), 4),
+        "PUMP_DUTY_RUN": int(round(float(res["pump_duty"][i]))),
+    }
+
+def config_lines(values, res=None, i=None):
+    out = ["# ---- Recommended by ecm_sim.py " + time.strftime("%Y-%m-%d %H:%M") + " ----"]
+    if res is not None and i is not None and not res["safe"][i]:
+        out.append(f"# WARNING: no setting under short risk {RISK_MAX}; this is the lowest-risk one")
+    if res is not None and i is not None:
+        out.append(f"# predicted: cycle {res['cycle_s'][i]:.1f} s, I {res['current_A'][i]:.2f} A, "
+                   f"gap {res['gap_mm'][i]*1000:.0f} µm, overcut {res['overcut_mm'][i]:.3f} mm "
+                   f"(target {res['overcut_target_mm'][i]:.3f}), short risk {res['short_risk'][i]:.3f}")
+    w = max(len(k) for k in values)
+    out += [f"{k:<{w}} = {v!r}" for k, v in values.items()]
+    return "\n".join(out) + "\n"
+
+def apply_to_config(values, path=None):
+    """Rewrite `NAME = value` assignments in config.py in place, keeping comments."""
+    path = path or config.__file__
+    with open(path) as fh:
+        text = fh.read()
+    for k, v in values.items():
+        pat = re.compile(rf"^({k}\s*=\s*)([^#\n]*?)(\s*(#.*)?)$", re.M)
+        if pat.search(text):
+            text = pat.sub(lambda m: f"{m.group(1)}{v!r}{m.group(3)}", text)
+        else:
+            text += f"\n{k} = {v!r}\n"
+    with open(path, "w") as fh:
+        fh.write(text)
+
+def _floats(s):
+    return [float(x) for x in s.split(",") if x]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Equilibrium-gap ECM parameter sweep.")
+    ap.add_argument("--voltages", type=_floats, default=list(np.arange(4.0, PSU_MAX_V + 0.1, 1.0)))
+    ap.add_argument("--feeds", type=_floats,
+                    default=list(np.geomspace(MIN_FEED_MM_S, MAX_FEED_MM_S, 120)))
+    ap.add_argument("--duties", type=_floats, default=list(range(20, 101, 10)))
+    ap.add_argument("--overcut", type=float, default=OVERCUT_MM, help="side overcut target (mm)")
+    ap.add_argument("--material", default=None, help="profiles.py material (default: config MATERIAL)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--out", default=None, help="write recommended settings to this file")
+    ap.add_argument("--apply", action="store_true", help="rewrite the values in config.py")
+    ap.add_argument("--check", action="store_true",
+                    help="exit 1 unless the sweep finds at least one safe setting (model sanity check)")
+    a = ap.parse_args(argv)
+
+    import profiles
+    try:
+        K = profiles.compile_profile(material=a.material or profiles.MATERIAL).k_mm3_per_coulomb
+    except profiles.ProfileError as e:
+        print(f"[ERR] {e}")
+        return 1
+    t0 = time.perf_counter()
+    res = sweep(a.voltages, a.feeds, a.duties, [a.overcut], workers=a.workers, K=K)
+    n = res["cycle_s"].size
+    print(f"[SIM] {n} combinations in {time.perf_counter() - t0:.3f}s "
+          f"({int(res['safe'].sum())} safe, {int(res['feasible'].sum())} on the overcut target)")
+    best = rank(res, a.top)
+    if a.check:
+        print(f"[SIM] check {'OK' if res['safe'].any() else 'FAILED: no safe setting'}")
+        return 0 if res["safe"].any() else 1
+    unsafe = not res["safe"][best[0]]
+    if unsafe:
+        i = best[0]
+        print(f"[SIM] WARNING: no setting under short risk {RISK_MAX} in the machine's feed range; "
+              f"falling back to the lowest risk {res['short_risk'][i]:.3f} "
+              f"(void fraction {res['void_fraction'][i]:.2f}, gap {res['gap_mm'][i]*1000:.0f} µm).")
+    elif not res["feasible"][best[0]]:
+        print(f"[SIM] Overcut target {a.overcut:.3f} mm is not reachable safely; "
+              f"closest is {res['overcut_mm'][best[0]]:.3f} mm.")
+    for i in best:
+        print(f"  V={res['voltage_V'][i]:5.1f}  feed={res['feed_mm_s'][i]:.4f}  "
+              f"duty={res['pump_duty'][i]:3.0f}%  cycle={res['cycle_s'][i]:7.1f}s  "
+              f"I={res['current_A'][i]:5.2f}A  overcut={res['overcut_mm'][i]:.3f}mm  "
+              f"risk={res['short_risk'][i]:.3f}")
+
+    vals = recommended(res, best[0])
+    text = config_lines(vals, res, best[0])
+    print(text, end="")
+    if a.out:
+        d = os.path.dirname(a.out)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(a.out, "w") as fh:
+            fh.write(text)
+        print(f"[SIM] Wrote {a.out}")
+    if a.apply and unsafe:
+        print("[SIM] Not applying an unsafe setting to config.py.")
+        return 1
+    if a.apply:
+        apply_to_config(vals)
+        print(f"[SIM] Updated {config.__file__}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
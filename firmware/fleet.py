@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Fleet coordinator
+Dispatches a batch of drilling jobs across several machines running
+jobserver.py. Each machine is kept at most FLEET_MAX_QUEUED jobs deep; the
+next job goes to the compatible machine with the earliest expected finish
+(queue depth × reported mean cycle time), so faster or idle machines get
+more work.
+
+Usage:
+    python3 fleet.py --machines http://pi1:8750,http://pi2:8750 --jobs jobs.json
+    python3 fleet.py --sim 3 --holes 12          # three simulated machines on this host
+
+jobs.json is a list of job objects as accepted by POST /jobs.
+"""
+import argparse, json, sys, time
+import urllib.request, urllib.error
+
+from config import (FLEET_MAX_QUEUED, FLEET_POLL_S, TARGET_DEPTH_MM, TOOL_DIAMETER_MM,
+                    ECM_FEED_MM_S, PUMP_DUTY_RUN, JOB_DIAMETER_TOL_MM)
+
+class Machine:
+    """HTTP client for one job server."""
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.last = {}
+        self.ok = True
+
+    def _req(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as r:
+            return json.loads(r.read() or b"null")
+
+    def status(self) -> dict:
+        try:
+            self.last = self._req("GET", "/status")
+            self.ok = True
+        except (urllib.error.URLError, OSError, ValueError):
+            self.ok = False
+        return self.last
+
+    def submit(self, params: dict) -> dict:
+        return self._req("POST", "/jobs", params)
+
+    def job(self, job_id: str) -> dict:
+        return self._req("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id: str) -> dict:
+        return self._req("DELETE", f"/jobs/{job_id}")
+
+    def events(self, job_id: str):
+        """Yield NDJSON progress events until the job finishes."""
+        with urllib.request.urlopen(f"{self.url}/jobs/{job_id}/events", timeout=None) as r:
+            for line in r:
+                if line.strip():
+                    yield json.loads(line)
+
+class Coordinator:
+    def __init__(self, urls, max_queued: int = FLEET_MAX_QUEUED, poll_s: float = FLEET_POLL_S,
+                 default_cycle_s: float = None):
+        self.machines = [Machine(u) for u in urls]
+        self.max_queued = max_queued
+        self.poll_s = poll_s
+        # prior for machines that have not finished a job yet
+        self.default_cycle_s = default_cycle_s or TARGET_DEPTH_MM / ECM_FEED_MM_S
+
+    @staticmethod
+    def _load(st: dict) -> int:
+        return st.get("queue_len", 0) + (1 if st.get("state") == "busy" else 0)
+
+    def _eta(self, m: Machine, outstanding: int) -> float:
+        st = m.last
+        cyc = st.get("mean_cycle_s") or self.default_cycle_s
+        return (max(self._load(st), outstanding) + 1) * cyc
+
+    @staticmethod
+    def _fits(params: dict, st: dict) -> bool:
+        """Tool matches as the job server checks it (malformed values are left to the server's 400)."""
+        try:
+            d = float(params.get("diameter_mm", st["tool_diameter_mm"]))
+        except (TypeError, ValueError):
+            return True
+        return abs(d - st["tool_diameter_mm"]) <= JOB_DIAMETER_TOL_MM
+
+    def _pick(self, params: dict, outstanding: dict):
+        best, best_eta = None, None
+        for m in self.machines:
+            st = m.last
+            if not m.ok or not st:
+                continue
+            if not self._fits(params, st):
+                continue
+            if outstanding[m.url] >= self.max_queued + 1:
+                continue
+            eta = self._eta(m, outstanding[m.url])
+            if best_eta is None or eta < best_eta:
+                best, best_eta = m, eta
+        return best
+
+    def run(self, jobs, on_event=None) -> dict:
+        """Dispatch `jobs` (list of param dicts) and wait for all of them."""
+        pending = list(enumerate(jobs))
+        live = {}           # (machine url, job id) → (index, Machine)
+        outstanding = {m.url: 0 for m in self.machines}
+        results = [None] * len(jobs)
+        t0 = time.time()
+        while pending or live:
+            for m in self.machines:
+                m.status()
+            # collect finished jobs
+            for key, (idx, m) in list(live.items()):
+                try:
+                    j = m.job(key[1])
+                except (urllib.error.URLError, OSError):
+                    continue
+                if j["state"] in ("done", "failed", "cancelled"):
+                    j["machine"] = m.last.get("machine", m.url)
+                    results[idx] = j
+                    outstanding[m.url] -= 1
+                    del live[key]
+                    if on_event:
+                        on_event("finished", j)
+            # dispatch
+            while pending:
+                idx, params = pending[0]
+                m = self._pick(params, outstanding)
+                if m is None:
+                    up = [m for m in self.machines if m.ok and m.last]
+                    if up and not any(self._fits(params, m.last) for m in up):
+                        results[idx] = {"state": "rejected", "params": params,
+                                        "error": "no machine has a matching tool"}
+                        pending.pop(0)
+                        continue
+                    break
+                try:
+                    j = m.submit(params)
+                except urllib.error.HTTPError as e:
+                    results[idx] = {"state": "rejected", "params": params,
+                                    "error": json.loads(e.read() or b"{}").get("error", str(e))}
+                    pending.pop(0)
+                    continue
+                except (urllib.error.URLError, OSError):
+                    m.ok = False
+                    continue
+                pending.pop(0)
+                live[(m.url, j["id"])] = (idx, m)
+                outstanding[m.url] += 1
+                if on_event:
+                    on_event("dispatched", dict(j, machine=m.last.get("machine", m.url)))
+            if pending and not any(m.ok for m in self.machines):
+                raise RuntimeError("no reachable machines")
+            if pending or live:
+                time.sleep(self.poll_s)
+        return self._summary(results, time.time() - t0)
+
+    def _summary(self, results, wall_s):
+        per = {}
+        for r in results:
+            if r and r.get("state") == "done":
+                per.setdefault(r["machine"], []).append(r["finished"] - r["started"])
+        return {
+            "wall_s": wall_s,
+            "done": sum(1 for r in results if r and r.get("state") == "done"),
+            "failed": sum(1 for r in results if r and r.get("state") != "done"),
+            "holes_per_hour": 3600.0 * sum(len(v) for v in per.values()) / wall_s if wall_s else 0.0,
+            "per_machine": {k: {"holes": len(v), "mean_s": sum(v) / len(v)} for k, v in per.items()},
+            "results": results,
+        }
+
+def start_sim_fleet(n: int, base_scale: float = 0.002):
+    """Start n simulated job servers in-process on free localhost ports; returns URLs.
+    Machines get different speeds so dispatch-by-throughput is visible."""
+    from jobserver import JobServer, SimBackend, serve_in_thread
+    urls = []
+    for k in range(n):
+        jobs = JobServer(SimBackend(time_scale=base_scale * (1 + k)), name=f"sim{k}")
+        _srv, url = serve_in_thread(jobs)
+        urls.append(url)
+    return urls
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Dispatch drilling jobs across ECM machines.")
+    ap.add_argument("--machines", default="", help="comma-separated job server URLs")
+    ap.add_argument("--jobs", default=None, help="JSON file with a list of jobs")
+    ap.add_argument("--sim", type=int, default=0, help="start N simulated machines on this host")
+    ap.add_argument("--holes", type=int, default=6, help="with no --jobs: N default holes")
+    a = ap.parse_args(argv)
+
+    urls = [u for u in a.machines.split(",") if u]
+    if a.sim:
+        urls += start_sim_fleet(a.sim)
+    if not urls:
+        ap.error("no machines (use --machines or --sim)")
+    if a.jobs:
+        with open(a.jobs) as f:
+            jobs = json.load(f)
+    else:
+        jobs = [{"depth_mm": TARGET_DEPTH_MM, "diameter_mm": TOOL_DIAMETER_MM,
+                 "feed_mm_s": ECM_FEED_MM_S, "pump_duty": PUMP_DUTY_RUN}] * a.holes
+
+    def log(kind, j):
+        if kind == "dispatched":
+            print(f"[FLEET] {j['id']} → {j['machine']}")
+        else:
+            print(f"[FLEET] {j['id']} {j['state']} on {j['machine']}")
+
+    print(f"[FLEET] {len(jobs)} jobs across {len(urls)} machines")
+    s = Coordinator(urls).run(jobs, on_event=log)
+    print(f"[FLEET] done={s['done']} failed={s['failed']} wall={s['wall_s']:.1f}s "
+          f"({s['holes_per_hour']:.0f} holes/h)")
+    for name, v in sorted(s["per_machine"].items()):
+        print(f"  {name:<12} holes={v['holes']:3d}  mean={v['mean_s']:.2f}s")
+    return 0 if s["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Flow estimate and closed-loop pump control
+There is no flow sensor, so flow is inferred from the pump branch current
+(INA219 @ INA_PUMP_ADDR). A small DC centrifugal pump draws less current
+when its outlet is restricted and much less when it runs dry, so at a given
+duty the flow is taken as proportional to how far the current sits between
+the dry-run level and the calibrated free-flow level:
+
+    Q = Q_cal(duty) · (I − I_dry(duty)) / (I_cal(duty) − I_dry(duty))
+
+Calibration (per pump, LOG_DIR/flow_<PUMP_ID>.json) sweeps the duty, records
+the settled current and, if given, a bucket-measured flow at each point.
+
+FlowController holds a target flow with a PI loop and soft duty ramps, and
+flags clogs (current ratio sagging) and dry running (pump stopped).
+
+Usage:
+    python3 flow.py calibrate                  # prompts for bucket readings
+    python3 flow.py calibrate --no-measure     # flow from PUMP_MAX_LMIN × duty
+    python3 flow.py hold 0.6                   # hold 0.6 L/min until Ctrl+C
+"""
+import argparse, json, os, sys, threading, time
+
+from config import (LOG_DIR, PUMP_ID, PUMP_MAX_LMIN, FLOW_TARGET_LMIN,
+                    FLOW_CAL_DUTIES, FLOW_CAL_SETTLE_S, FLOW_DRY_FRAC,
+                    FLOW_CTRL_HZ, FLOW_KP, FLOW_KI, FLOW_RAMP_PCT_S,
+                    FLOW_DUTY_MIN, FLOW_DUTY_MAX, FLOW_CLOG_RATIO,
+                    FLOW_FAULT_HOLD_S)
+
+NAN = float("nan")
+
+def _path(pump_id: str) -> str:
+    return os.path.join(LOG_DIR, f"flow_{pump_id}.json")
+
+class FlowModel:
+    """Calibration table: duty → (free-flow current mA, flow L/min)."""
+    def __init__(self, points, pump_id: str = PUMP_ID, dry_frac: float = FLOW_DRY_FRAC, created=None):
+        self.points = sorted((float(d), float(i), float(q)) for d, i, q in points)
+        if not self.points:
+            raise ValueError("flow model needs at least one calibration point")
+        self.pump_id = pump_id
+        self.dry_frac = float(dry_frac)
+        self.created = created or time.time()
+
+    # ---- persistence ----
+    def save(self, path: str = None) -> str:
+        path = path or _path(self.pump_id)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"pump_id": self.pump_id, "created": self.created, "dry_frac": self.dry_frac,
+                       "points": [{"duty": d, "I_mA": i, "Lmin": q} for d, i, q in self.points]},
+                      f, indent=1)
+        return path
+
+    @classmethod
+    def load(cls, pump_id: str = PUMP_ID, path: str = None):
+        with open(path or _path(pump_id)) as f:
+            d = json.load(f)
+        return cls([(p["duty"], p["I_mA"], p["Lmin"]) for p in d["points"]],
+                   d.get("pump_id", pump_id), d.get("dry_frac", FLOW_DRY_FRAC), d.get("created"))
+
+    @classmethod
+    def load_or_none(cls, pump_id: str = PUMP_ID):
+        try:
+            return cls.load(pump_id)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # ---- model ----
+    def nominal(self, duty: float):
+        """(I_cal mA, Q_cal L/min) at `duty`, linear between points, → 0 below the first."""
+        pts = self.points
+        duty = float(duty)
+        if duty <= pts[0][0]:
+            k = max(0.0, duty / pts[0][0]) if pts[0][0] > 0 else 0.0
+            return pts[0][1] * k, pts[0][2] * k
+        for (d0, i0, q0), (d1, i1, q1) in zip(pts, pts[1:]):
+            if duty <= d1:
+                w = (duty - d0) / (d1 - d0) if d1 > d0 else 0.0
+                return i0 + w * (i1 - i0), q0 + w * (q1 - q0)
+        return pts[-1][1], pts[-1][2]
+
+    def current_ratio(self, duty: float, I_mA: float) -> float:
+        i_cal, _ = self.nominal(duty)
+        return I_mA / i_cal if i_cal > 0 else NAN
+
+    def estimate(self, duty: float, I_mA: float) -> float:
+        """Estimated flow (L/min); NaN if the current sample is NaN."""
+        if I_mA != I_mA:
+            return NAN
+        i_cal, q_cal = self.nominal(duty)
+        if i_cal <= 0 or q_cal <= 0:
+            return 0.0
+        i_dry = i_cal * self.dry_frac
+        x = (I_mA - i_dry) / (i_cal - i_dry)
+        return q_cal * max(0.0, min(1.5, x))
+
+    def duty_for(self, flow_Lmin: float) -> float:
+        """Feed-forward: duty that gives `flow_Lmin` with a clean circuit."""
+        prev = (0.0, 0.0, 0.0)
+        for p in self.points:
+            if flow_Lmin <= p[2]:
+                d0, _i0, q0 = prev
+                d1, _i1, q1 = p
+                return d0 + (d1 - d0) * (flow_Lmin - q0) / (q1 - q0) if q1 > q0 else d1
+            prev = p
+        return self.points[-1][0]
+
+class FlowEstimator:
+    """Binds a model to the live pump-current channel; plugs into PumpController(flow=...)."""
+    def __init__(self, model: FlowModel, instr):
+        self.model = model
+        self.instr = instr
+
+    def pump_current_mA(self) -> float:
+        return float(self.instr.snapshot().get("pump_I_mA", NAN))
+
+    def estimate(self, duty: float) -> float:
+        return self.model.estimate(duty, self.pump_current_mA())
+
+def estimator_for(instr, pump_id: str = PUMP_ID):
+    """FlowEstimator if this pump is calibrated and the pump INA219 is in use, else None."""
+    if instr is None or getattr(instr, "pump", None) is None:
+        return None
+    model = FlowModel.load_or_none(pump_id)
+    return FlowEstimator(model, instr) if model else None
+
+def calibrate(pump, instr, duties=FLOW_CAL_DUTIES, settle_s=FLOW_CAL_SETTLE_S,
+              measure=None, pump_id: str = PUMP_ID, samples: int = 20) -> FlowModel:
+    """Sweep duty, average settled pump current. `measure(duty)` returns a
+    bucket-measured L/min (None → PUMP_MAX_LMIN × duty)."""
+    pts = []
+    for duty in duties:
+        pump.set_duty(duty)
+        time.sleep(settle_s)
+        vals = []
+        for _ in range(samples):
+            v = float(instr.snapshot().get("pump_I_mA", NAN))
+            if v == v:
+                vals.append(v)
+            time.sleep(0.05)
+        if not vals:
+            raise RuntimeError(f"no pump current readings at {duty}% (is INA_PUMP_ADDR wired?)")
+        i_mA = sum(vals) / len(vals)
+        q = measure(duty) if measure else None
+        if q is None:
+            q = PUMP_MAX_LMIN * duty / 100.0
+        pts.append((duty, i_mA, q))
+        print(f"[FLOW] duty={duty:>3}%  I={i_mA:7.1f} mA  Q={q:.3f} L/min")
+    pump.off()
+    return FlowModel(pts, pump_id)
+
+class FlowController:
+    """
+    Background PI loop holding a target flow by adjusting pump duty, with a
+    duty slew limit for soft starts/changes. state: "off", "ramping", "ok",
+    "clog" (flow held only by saturating duty, or current sagging) or "dry"
+    (pump stopped). on_fault(state) is called from the control thread.
+    hold(duty) overrides the loop with a fixed duty (peck flush boost).
+    """
+    def __init__(self, pump, estimator: FlowEstimator, target_Lmin: float = FLOW_TARGET_LMIN,
+                 hz: float = FLOW_CTRL_HZ, on_fault=None):
+        self.pump = pump
+        self.est = estimator
+        self.model = estimator.model
+        self.target = float(target_Lmin)
+        self.period_s = 1.0 / float(hz)
+        self.on_fault = on_fault
+        self.state = "off"
+        self.flow_Lmin = NAN
+        self.duty = 0.0
+        self._integ = 0.0
+        self._clog_since = None
+        self._dry_since = None
+        self._hold = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_target(self, target_Lmin: float):
+        self.target = float(target_Lmin)
+
+    def hold(self, duty=None):
+        """Override the loop with a fixed duty (e.g. a flush boost); hold(None) hands
+        the pump back at the loop's own duty. Ignored once dry is latched."""
+        with self._lock:
+            if self.state == "dry":
+                return
+            self._hold = None if duty is None else float(duty)
+            self.pump.set_duty(self.duty if duty is None else duty)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.duty = self.pump.duty
+        self._integ = 0.0
+        self._hold = None
+        self.state = "ramping"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="flow", daemon=True)
+        self._thread.start()
+
+    def stop(self, pump_off: bool = True):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if pump_off:
+            self.pump.off()
+        self.state = "off"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _fault(self, state: str):
+        if self.state != state:
+            self.state = state
+            print(f"[FLOW] {state.upper()} detected (duty {self.duty:.0f}%, I ratio low)")
+            if self.on_fault:
+                self.on_fault(state)
+
+    def step(self, dt: float):
+        """One control update (also usable without the thread)."""
+        with self._lock:
+            if self.state != "dry" and self._hold is None:      # dry latches until stop()/start()
+                self._step(dt)
+
+    def _step(self, dt: float):
+        i_mA = self.est.pump_current_mA()
+        q = self.model.estimate(self.duty, i_mA)
+        self.flow_Lmin = q
+        ff = self.model.duty_for(self.target)
+        if q == q:
+            err = self.target - q
+            self._integ += err * dt
+            # anti-windup: keep the integral term inside the duty range
+            lim = (FLOW_DUTY_MAX - FLOW_DUTY_MIN) / max(FLOW_KI, 1e-9)
+            self._integ = max(-lim, min(lim, self._integ))
+            want = ff + FLOW_KP * err + FLOW_KI * self._integ
+        else:
+            want = ff
+        want = max(FLOW_DUTY_MIN, min(FLOW_DUTY_MAX, want))
+        step = FLOW_RAMP_PCT_S * dt
+        self.duty += max(-step, min(step, want - self.duty))
+        self.pump.set_duty(self.duty)
+
+        # fault detection (only once the ramp has reached the commanded duty)
+        ramping = abs(want - self.duty) > 1e-6
+        ratio = self.model.current_ratio(self.duty, i_mA)
+        now = time.monotonic()
+        if ratio == ratio and not ramping:
+            self._dry_since = (self._dry_since or now) if ratio <= self.model.dry_frac else None
+            starved = ratio < FLOW_CLOG_RATIO or (self.duty >= FLOW_DUTY_MAX and q == q and q < 0.8 * self.target)
+            self._clog_since = (self._clog_since or now) if starved else None
+            if self._dry_since and now - self._dry_since >= FLOW_FAULT_HOLD_S:
+                self.pump.off()
+                self.duty = 0.0
+                self._fault("dry")
+                self._stop.set()
+                return
+            if self._clog_since and now - self._clog_since >= FLOW_FAULT_HOLD_S:
+                self._fault("clog")
+                return
+        if self.state not in ("clog", "dry"):
+            self.state = "ramping" if ramping else "ok"
+        elif self._clog_since is None:
+            self.state = "ok"
+
+    def _run(self):
+        last = time.monotonic()
+        while not self._stop.wait(self.period_s):
+            now = time.monotonic()
+            self.step(now - last)
+            last = now
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pump flow calibration and closed-loop hold.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("calibrate"); p.add_argument("--no-measure", action="store_true")
+    p = sub.add_parser("hold");      p.add_argument("target", type=float, nargs="?", default=FLOW_TARGET_LMIN)
+    a = ap.parse_args(argv)
+
+    import RPi.GPIO as GPIO
+    from pump import PumpController
+    from sensors import Instrumentation
+    pump = PumpController()
+    instr = Instrumentation(use_pump_sensor=True)
+    try:
+        if a.cmd == "calibrate":
+            def ask(duty):
+                s = input(f"[FLOW] measured L/min at {duty}% (blank = estimate): ").strip()
+                return float(s) if s else None
+            model = calibrate(pump, instr, measure=None if a.no_measure else ask)
+            print(f"[FLOW] saved {model.save()}")
+        else:
+            est = estimator_for(instr)
+            if est is None:
+                print(f"[ERR] no calibration for {PUMP_ID}; run: python3 flow.py calibrate")
+                return 1
+            with FlowController(pump, est, a.target) as fc:
+                while fc.state != "dry":
+                    print(f"[FLOW] {fc.state:<8} target={fc.target:.2f}  "
+                          f"est={fc.flow_Lmin:.2f} L/min  duty={fc.duty:5.1f}%", end="\r")
+                    time.sleep(0.5)
+                print()
+    except KeyboardInterrupt:
+        print("\n[SYS] KeyboardInterrupt")
+    finally:
+        pump.off()
+        GPIO.cleanup()
+        pump.close()
+        instr.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+ECM Drill – I2C bus scheduler
+One thread owns the shared busio.I2C and serialises every transaction.
+Devices are sampled on their own cadence (ECM INA219 fast, pump/housekeeping
+slow, ECM first when both are due) and consumers read the latest cached
+sample without touching the bus. Failed transactions are retried; after
+I2C_RECOVER_AFTER consecutive failures the bus is re-opened and the device
+drivers rebuilt. Failed samples are NaN, never silent zeros.
+
+Usage:
+    bus = get_bus()
+    bus.add_device("ecm", opener=lambda i2c: INA219(i2c, addr=0x40),
+                   reader=lambda ina: (ina.bus_voltage, ...), hz=200, priority=PRIO_HIGH)
+    t, values = bus.latest("ecm")
+    bus.transact(lambda i2c: ..., priority=PRIO_LOW)   # one-off, blocking
+"""
+import heapq, itertools, threading, time
+
+import looptrace
+from config import I2C_RETRIES, I2C_RECOVER_AFTER, I2C_STALE_S
+
+PRIO_HIGH = 0
+PRIO_LOW  = 1
+PRIO_HOUSEKEEPING = 2
+
+NAN = float("nan")
+
+def default_i2c():
+    import board, busio
+    return busio.I2C(board.SCL, board.SDA)
+
+class _Device:
+    def __init__(self, name, opener, reader, period_s, priority, on_sample):
+        self.name = name
+        self.opener = opener
+        self.reader = reader
+        self.period_s = period_s
+        self.priority = priority
+        self.on_sample = on_sample
+        self.handle = None
+        self.latest = (0.0, None)        # (monotonic t, values or None)
+        # stats
+        self.reads = 0
+        self.errors = 0
+        self.retries = 0
+        self.fail_streak = 0
+        self.busy_s = 0.0
+
+class _Request:
+    __slots__ = ("fn", "done", "result", "error")
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class BusScheduler:
+    def __init__(self, i2c_factory=default_i2c, retries=I2C_RETRIES, recover_after=I2C_RECOVER_AFTER):
+        self._factory = i2c_factory
+        self.retries = int(retries)
+        self.recover_after = int(recover_after)
+        self.i2c = None
+        self.devices = {}
+        self.recoveries = 0
+        self._heap = []                  # (due, priority, seq, device)
+        self._requests = []              # (priority, seq, _Request)
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._add_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._t0 = time.monotonic()
+
+    # ---- setup ----
+    def _open_bus(self):
+        if self.i2c is None:
+            self.i2c = self._factory()
+        return self.i2c
+
+    def add_device(self, name, opener, reader, hz, priority=PRIO_LOW, on_sample=None):
+        """Register a periodically sampled device (idempotent per name).
+        The driver is opened on the bus thread; raises if it cannot be opened."""
+        with self._add_lock:
+            if name in self.devices:
+                return self.devices[name]
+            self.start()
+            handle = self.transact(opener, priority=PRIO_HIGH)
+            dev = _Device(name, opener, reader, 1.0 / float(hz), priority, on_sample)
+            dev.handle = handle
+            with self._cv:
+                self.devices[name] = dev
+                heapq.heappush(self._heap, (time.monotonic(), priority, next(self._seq), dev))
+                self._cv.notify()
+        return dev
+
+    def start(self):
+        with self._cv:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="i2c", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cv:
+            self._running = False
+            self._cv.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    # ---- consumer API ----
+    def latest(self, name: str, max_age_s: float = I2C_STALE_S):
+        """(t, values) of the newest sample; values is None if failed or stale."""
+        dev = self.devices.get(name)
+        if dev is None:
+            return (0.0, None)
+        t, v = dev.latest
+        if v is None or time.monotonic() - t > max_age_s:
+            return (t, None)
+        return (t, v)
+
+    def transact(self, fn, priority=PRIO_LOW, timeout: float = 1.0):
+        """Run fn(i2c) on the bus thread, ahead of periodic samples of lower priority."""
+        req = _Request(fn)
+        with self._cv:
+            heapq.heappush(self._requests, (priority, next(self._seq), req))
+            self._cv.notify()
+        if not req.done.wait(timeout):
+            raise TimeoutError("I2C transaction timed out")
+        if req.error:
+            raise req.error
+        return req.result
+
+    def stats(self) -> dict:
+        """Per-device reads/s, error rate, retries and bus time."""
+        el = max(1e-9, time.monotonic() - self._t0)
+        out = {"recoveries": self.recoveries, "devices": {}}
+        for name, d in self.devices.items():
+            tries = d.reads + d.errors
+            out["devices"][name] = {
+                "reads": d.reads,
+                "errors": d.errors,
+                "retries": d.retries,
+                "reads_per_s": d.reads / el,
+                "error_rate": d.errors / tries if tries else 0.0,
+                "busy_frac": d.busy_s / el,
+            }
+        return out
+
+    # ---- bus thread ----
+    def _recover(self):
+        """Re-open the bus and rebuild device drivers after repeated NAKs."""
+        self.recoveries += 1
+        try:
+            if self.i2c is not None and hasattr(self.i2c, "deinit"):
+                self.i2c.deinit()
+        except Exception:
+            pass
+        self.i2c = None
+        for d in self.devices.values():
+            d.fail_streak = 0        # a failed recovery is retried after another streak
+        try:
+            i2c = self._open_bus()
+            for d in self.devices.values():
+                d.handle = d.opener(i2c)
+        except Exception:
+            self.i2c = None
+        print(f"[I2C] Bus recovery #{self.recoveries}")
+
+    def _sample(self, dev: _Device):
+        t0 = time.monotonic()
+        vals = None
+        with looptrace.span("i2c." + dev.name):
+            for attempt in range(self.retries + 1):
+                try:
+                    if dev.handle is None:
+                        raise OSError("device not open")
+                    vals = tuple(float(x) for x in dev.reader(dev.handle))
+                    break
+                except Exception:
+                    if attempt < self.retries:
+                        dev.retries += 1
+        now = time.monotonic()
+        dev.busy_s += now - t0
+        if vals is None:
+            dev.errors += 1
+            dev.fail_streak += 1
+            dev.latest = (now, None)
+            if dev.fail_streak >= self.recover_after:
+                self._recover()
+        else:
+            dev.reads += 1
+            dev.fail_streak = 0
+            if dev.on_sample:
+                vals = dev.on_sample(vals)
+            dev.latest = (now, vals)
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while self._running:
+                    if self._requests:
+                        _p, _s, req = heapq.heappop(self._requests)
+                        job = ("req", req)
+                        break
+                    if self._heap:
+                        now = time.monotonic()
+                        wait = self._heap[0][0] - now
+                        if wait <= 0:
+                            # of everything due, serve the highest priority first
+                            ready = []
+                            while self._heap and self._heap[0][0] <= now:
+                                ready.append(heapq.heappop(self._heap))
+                            ready.sort(key=lambda e: (e[1], e[0]))
+                            due, _prio, _seq, dev = ready[0]
+                            for e in ready[1:]:
+                                heapq.heappush(self._heap, e)
+                            job = ("dev", dev)
+                            break
+                        self._cv.wait(wait)
+                    else:
+                        self._cv.wait()
+                else:
+                    return
+            if job[0] == "req":
+                req = job[1]
+                try:
+                    req.result = req.fn(self._open_bus())
+                except Exception as e:
+                    req.error = e
+                req.done.set()
+            else:
+                dev = job[1]
+                self._sample(dev)
+                with self._cv:
+                    # next slot on the device's own grid; skip missed slots rather than bursting
+                    nxt = due + dev.period_s
+                    now = time.monotonic()
+                    if nxt < now:
+                        nxt = now + dev.period_s - ((now - due) % dev.period_s)
+                    heapq.heappush(self._heap, (nxt, dev.priority, next(self._seq), dev))
+
+_BUS = None
+_BUS_LOCK = threading.Lock()
+
+def get_bus() -> BusScheduler:
+    """Process-wide scheduler for the Pi's I2C bus."""
+    global _BUS
+    with _BUS_LOCK:
+        if _BUS is None:
+            _BUS = BusScheduler()
+        return _BUS
+
+def nan_tuple(n: int):
+    return (NAN,) * n
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Job server
+Per-machine job API: accepts drilling jobs over local HTTP (or a Unix
+socket), queues them, runs them one at a time as peck cycles and streams
+status. fleet.py dispatches batches across several of these.
+
+Endpoints (JSON):
+    GET    /status              machine state, queue length, throughput
+    GET    /jobs                all jobs
+    POST   /jobs                {"depth_mm", "diameter_mm", "feed_mm_s", "pump_duty", ...} (or a list)
+    GET    /jobs/<id>           one job
+    GET    /jobs/<id>/events    NDJSON stream of progress until the job finishes
+    DELETE /jobs/<id>           cancel (queued jobs dropped, running job stopped at next step)
+    GET    /profile             active machine/material profile
+    POST   /profile             {"machine", "material"} switch profile (only while idle, queue empty)
+    POST   /ready               operator: part positioned for the next job
+
+The first job drills at the current tool position, starting from the work
+surface. Between jobs the tool waits at the clearance plane until the
+operator confirms (POST /ready), then re-approaches the surface.
+
+Usage:
+    python3 jobserver.py                         # real hardware on JOB_SERVER_PORT
+    python3 jobserver.py --unix /tmp/ecm.sock
+    python3 jobserver.py --record data/jobs.jsonl     # data/jobs_<job id>.jsonl per job for replay.py
+    python3 jobserver.py --sim --port 8751 --time-scale 0.01    # simulated machine, 100× fast
+"""
+import argparse, itertools, json, math, os, queue, socket, socketserver, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (JOB_SERVER_PORT, JOB_MAX_DEPTH_MM, JOB_MAX_DWELL_S, JOB_DIAMETER_TOL_MM,
+                    PECK_RAPID_MM_S, PECK_CLEARANCE_MM, BATCH_SURFACE_MM, BATCH_CLEAR_MM)
+import cycle
+import profiles
+from recorder import Recorder, hole_path
+from replay import (VirtualClock, Recording, ReplayMotion, ReplayPump,
+                    ReplayInstrumentation, ModelInstrumentation)
+
+class JobError(ValueError):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+# key → (lo, hi, lo inclusive); hi None = unbounded. Anything else is rejected.
+_LIMITS = {
+    "depth_mm":    (0.0, JOB_MAX_DEPTH_MM, False),
+    "diameter_mm": (0.0, None, False),
+    "feed_mm_s":   None,                    # machine profile's feed range
+    "pump_duty":   (0.0, 100.0, True),
+    "boost_duty":  (0.0, 100.0, True),
+    "chunk_mm":    (0.0, JOB_MAX_DEPTH_MM, False),
+    "retract_mm":  (0.0, JOB_MAX_DEPTH_MM, True),
+    "dwell_s":     (0.0, JOB_MAX_DWELL_S, True),
+    "every_s":     (0.0, None, True),       # 0 = trigger off
+    "every_mm":    (0.0, None, True),
+    "i_drop_frac": (0.0, 1.0, True),
+    "i_short_mA":  (0.0, None, False),
+}
+
+def _number(key, v) -> float:
+    if isinstance(v, bool) or not isinstance(v, (int, float)) or not math.isfinite(v):
+        raise JobError(f"{key} must be a number")
+    return float(v)
+
+def validate(params: dict) -> dict:
+    """Check and normalise job parameters; raises JobError."""
+    if not isinstance(params, dict):
+        raise JobError("job must be a JSON object")
+    unknown = sorted(set(params) - set(_LIMITS))
+    if unknown:
+        raise JobError(f"unknown job parameter(s): {', '.join(map(str, unknown))}")
+    if "depth_mm" not in params:
+        raise JobError("depth_mm is required")
+    m = profiles.active().machine
+    p = {}
+    for key, v in params.items():
+        x = _number(key, v)
+        lo, hi, lo_ok = _LIMITS[key] or (m.min_feed_mm_s, m.max_feed_mm_s, True)
+        if not ((x >= lo if lo_ok else x > lo) and (hi is None or x <= hi)):
+            rng = (f"{'≥' if lo_ok else '>'} {lo:g}" if hi is None else
+                   f"in {'[' if lo_ok else '('}{lo:g}, {hi:g}]")
+            raise JobError(f"{key} must be {rng}")
+        p[key] = x
+    step_mm = 1.0 / profiles.active().steps_per_mm
+    if p.get("chunk_mm", step_mm) < step_mm:      # sub-step chunks never move: the cycle would spin
+        raise JobError(f"chunk_mm must be ≥ one step ({step_mm:g} mm)")
+    d = p.setdefault("diameter_mm", m.tool_diameter_mm)
+    if abs(d - m.tool_diameter_mm) > JOB_DIAMETER_TOL_MM:
+        raise JobError(f"diameter_mm {d:g} does not match tool {m.tool_diameter_mm:g} mm")
+    return p
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, params: dict):
+        self.id = f"{os.getpid()}-{next(self._ids)}"
+        self.params = params
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.cut_started = None         # after any operator wait; cycle time counts from here
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancel = False
+        self.events = []
+        self._cv = threading.Condition()
+
+    def emit(self, **ev):
+        ev["t"] = round(time.time(), 3)
+        ev["job"] = self.id
+        with self._cv:
+            self.events.append(ev)
+            self._cv.notify_all()
+
+    def set_state(self, state: str, **extra):
+        self.state = state
+        self.emit(state=state, **extra)
+
+    @property
+    def finished_state(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    def wait_events(self, start: int, timeout: float = 1.0):
+        """Events from index `start`, blocking until some exist or the job finishes."""
+        with self._cv:
+            if len(self.events) <= start and not self.finished_state:
+                self._cv.wait(timeout)
+            return self.events[start:]
+
+    def as_dict(self) -> dict:
+        return {"id": self.id, "state": self.state, "params": self.params,
+                "submitted": self.submitted, "started": self.started, "cut_started": self.cut_started,
+                "finished": self.finished,
+                "result": self.result, "error": self.error}
+
+# ---- backends ----
+class HardwareBackend:
+    """
+    Runs jobs on this machine's motion/pump/safety hardware. The first job
+    starts at the work surface; after each job the tool lifts to the
+    clearance plane and the next job waits for the operator (POST /ready)
+    before approaching the surface again. After a fault the surface is
+    re-established by homing (batch.py geometry).
+    """
+    def __init__(self, record: str = None):
+        from flow import FlowController, estimator_for
+        from motion import MotionController, Guard
+        from pump import PumpController
+        from safety import SafetyManager
+        from sensors import Instrumentation
+        self.safety = SafetyManager()
+        self.motion = MotionController()
+        self.pump = PumpController()
+        self.instr = Instrumentation(use_pump_sensor=True)
+        self.recorder = None                # one replay.py recording per job: RECORD_<job id>.jsonl
+        if record:
+            self.recorder = Recorder(record, note="jobserver setup")
+            self.motion, self.pump, self.instr = self.recorder.wrap(self.motion, self.pump, self.instr)
+            self._record_base = record
+        est = estimator_for(self.instr)
+        self.flow = FlowController(self.pump, est) if est else None
+        self._Guard = Guard
+        self._ready = threading.Event()
+        self.waiting = False
+        self._parked = 0.0          # tool height above the surface, None = unknown
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        for c in (self.motion, self.pump, self.instr):
+            c.close()
+
+    def confirm(self):
+        """Operator: part positioned, go ahead with the next job."""
+        self._ready.set()
+
+    def _move(self, mm, feed, guards) -> bool:
+        want = self.motion.profile.steps(mm)
+        moved = self.motion.move_mm(mm, feed, guards)
+        return moved is None or moved >= want
+
+    def _wait_operator(self, job: Job):
+        self.waiting = True
+        job.emit(awaiting="operator")
+        print(f"[JOB] {job.id}: position the part, then POST /ready")
+        try:
+            while not self._ready.wait(0.2):
+                if job.cancel:
+                    raise JobCancelled()
+        finally:
+            self.waiting = False
+        self._ready.clear()
+
+    def _to_surface(self, feed, guards):
+        """Re-home if needed, then clearance plane → work surface (last PECK_CLEARANCE_MM at feed)."""
+        if self._parked is None:
+            self.motion.home()
+            if not self._move(-(BATCH_SURFACE_MM - BATCH_CLEAR_MM), PECK_RAPID_MM_S, guards):
+                raise RuntimeError("guard tripped moving to the clearance plane")
+            self._parked = BATCH_CLEAR_MM
+        h, self._parked = self._parked, None
+        rapid = h - PECK_CLEARANCE_MM
+        if rapid > 0 and not self._move(-rapid, PECK_RAPID_MM_S, guards):
+            raise RuntimeError("guard tripped during approach")
+        if not self._move(-min(PECK_CLEARANCE_MM, h), feed, guards):
+            raise RuntimeError("guard tripped during approach")
+        self._parked = 0.0
+
+    def run(self, job: Job, on_progress):
+        G = self._Guard
+        estop = G("estop", self.safety.estop_active, message="[SAFETY] E-STOP active → stopping.")
+        guards = (estop, G("cancel", lambda: job.cancel, message="[JOB] cancelled"))
+        if self._parked != 0.0:
+            self._wait_operator(job)
+        self.safety.relay_on()
+        try:
+            cyc = cycle.from_params(self.motion, self.pump, self.instr, job.params, guards=guards,
+                                    withdraw_guards=(estop,),     # a cancel must still get the tool out
+                                    on_progress=on_progress, flow=self.flow)
+            job.cut_started = time.time()
+            self.motion.set_enabled(True)
+            if self.recorder is not None:
+                self.recorder.rotate(hole_path(self._record_base, job.id), note=f"job {job.id}")
+            self._to_surface(cyc.feed_mm_s, guards)
+            if self.recorder is not None:
+                self.recorder.mark_surface()
+            self._parked = None
+            st = cyc.run()
+            if st.withdrawn:            # retract_mm above the surface, also after a cancel
+                lift = BATCH_CLEAR_MM - cyc.retract_mm
+                if lift <= 0 or self._move(lift, PECK_RAPID_MM_S, (estop,)):
+                    self._parked = max(BATCH_CLEAR_MM, cyc.retract_mm)
+            return st.as_dict()
+        finally:
+            self._ready.clear()     # only a confirm given after this job counts for the next
+            self.pump.off()
+            self.motion.set_enabled(False)
+            self.safety.relay_off()
+
+class ScaledClock(VirtualClock):
+    """Virtual clock that also sleeps `scale` real seconds per virtual second."""
+    def __init__(self, scale: float):
+        super().__init__()
+        self.scale = float(scale)
+
+    def sleep(self, dt: float):
+        super().sleep(dt)
+        if self.scale > 0 and dt > 0:
+            time.sleep(dt * self.scale)
+
+class SimBackend:
+    """Virtual machine (replay look-alikes); for testing the job API and fleet on one host."""
+    def __init__(self, time_scale: float = 0.01, recording: str = None):
+        self.time_scale = time_scale
+        self.recording = None
+        if recording:
+            self.recording = Recording.load(recording)
+
+    def run(self, job: Job, on_progress):
+        clock = ScaledClock(self.time_scale)
+        motion = ReplayMotion(clock)
+        pump = ReplayPump(clock)
+        instr = (ReplayInstrumentation(self.recording, motion) if self.recording
+                 else ModelInstrumentation(motion))
+
+        def progress(cyc):
+            if job.cancel:          # replay motion does not evaluate guards
+                raise JobCancelled()
+            on_progress(cyc)
+
+        cyc = cycle.from_params(motion, pump, instr, job.params,
+                                clock=clock.monotonic, sleep=clock.sleep, on_progress=progress)
+        d = cyc.run().as_dict()
+        d["sim_cycle_s"] = round(clock.now, 3)
+        return d
+
+# ---- server ----
+class JobServer:
+    def __init__(self, backend, name: str = None):
+        self.backend = backend
+        self.name = name or socket.gethostname()
+        self.jobs = {}
+        self.order = []
+        self._q = queue.Queue()
+        self._lock = threading.Lock()
+        self.current = None
+        self._done_s = []           # cut start → finish of completed jobs (operator wait excluded)
+        self._t_start = time.time()
+        self._worker = threading.Thread(target=self._run, name="jobs", daemon=True)
+        self._worker.start()
+
+    def submit(self, params: dict) -> Job:
+        job = Job(validate(params))
+        with self._lock:
+            self.jobs[job.id] = job
+            self.order.append(job.id)
+        job.emit(state="queued")
+        self._q.put(job)
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.jobs[job_id]
+        job.cancel = True
+        if job.state == "queued":
+            job.finished = time.time()
+            job.set_state("cancelled")
+        return job
+
+    def status(self) -> dict:
+        with self._lock:
+            queued = sum(1 for j in self.jobs.values() if j.state == "queued")
+            done = list(self._done_s)
+        mean = sum(done) / len(done) if done else None
+        return {
+            "machine": self.name,
+            "state": "busy" if self.current else "idle",
+            "current": self.current.id if self.current else None,
+            "queue_len": queued,
+            "completed": len(done),
+            "mean_cycle_s": mean,
+            "holes_per_hour": 3600.0 / mean if mean else None,
+            "tool_diameter_mm": profiles.active().machine.tool_diameter_mm,
+            "profile": profiles.active().name,
+            "awaiting_operator": getattr(self.backend, "waiting", False),
+            "uptime_s": round(time.time() - self._t_start, 1),
+        }
+
+    def _run(self):
+        while True:
+            job = self._q.get()
+            if job.state != "queued":
+                continue
+            self.current = job
+            job.started = time.time()
+            job.set_state("running")
+
+            def progress(cyc, job=job):
+                job.emit(depth_mm=round(cyc.depth_mm, 4), pecks=cyc.stats.pecks,
+                         i_mA=None if cyc.i_mA != cyc.i_mA else round(cyc.i_mA, 1))
+
+            try:
+                job.result = self.backend.run(job, progress)
+                job.finished = time.time()
+                if job.cancel:
+                    job.set_state("cancelled", result=job.result)
+                elif job.result.get("abort"):
+                    job.error = job.result["abort"]
+                    job.set_state("failed", error=job.error)
+                else:
+                    with self._lock:
+                        self._done_s.append(job.finished - (job.cut_started or job.started))
+                    job.set_state("done", result=job.result)
+            except JobCancelled:
+                job.finished = time.time()
+                job.set_state("cancelled")
+            except Exception as e:
+                job.finished = time.time()
+                job.error = str(e)
+                job.set_state("failed", error=job.error)
+                print(f"[JOB] {job.id} failed: {e}")
+            finally:
+                self.current = None
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "ECMJobServer/1"
+    jobs: JobServer = None          # set by make_server
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code: int, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job(self, parts):
+        job = self.jobs.jobs.get(parts[1]) if len(parts) > 1 else None
+        if job is None:
+            self._send(404, {"error": "no such job"})
+        return job
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts == ["status"]:
+            return self._send(200, self.jobs.status())
+        if parts == ["jobs"]:
+            return self._send(200, [self.jobs.jobs[i].as_dict() for i in self.jobs.order])
+        if parts == ["profile"]:
+            return self._send(200, profiles.active().as_dict())
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self._job(parts)
+            return job and self._send(200, job.as_dict())
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            job = self._job(parts)
+            return job and self._stream(job)
+        self._send(404, {"error": "not found"})
+
+    def _stream(self, job: Job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        i = 0
+        try:
+            while True:
+                evs = job.wait_events(i)
+                for ev in evs:
+                    self.wfile.write((json.dumps(ev) + "\n").encode())
+                i += len(evs)
+                self.wfile.flush()
+                if job.finished_state and i >= len(job.events):
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def _switch_profile(self):
+        n = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(n) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("profile request must be a JSON object")
+            if self.jobs.current is not None:
+                return self._send(409, {"error": "machine busy"})
+            if self.jobs.status()["queue_len"]:
+                return self._send(409, {"error": "jobs queued (validated against the current profile)"})
+            p = profiles.switch(body.get("machine"), body.get("material"))
+        except ValueError as e:            # includes ProfileError
+            return self._send(400, {"error": str(e)})
+        self._send(200, p.as_dict())
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/profile":
+            return self._switch_profile()
+        if self.path.rstrip("/") == "/ready":
+            if not hasattr(self.jobs.backend, "confirm"):
+                return self._send(404, {"error": "backend has no operator step"})
+            self.jobs.backend.confirm()
+            return self._send(200, self.jobs.status())
+        if self.path.rstrip("/") != "/jobs":
+            return self._send(404, {"error": "not found"})
+        try:
+            n = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(n) or b"{}")
+            items = body if isinstance(body, list) else [body]
+            for p in items:          # validate the whole batch before queueing any
+                validate(p)
+            jobs = [self.jobs.submit(p) for p in items]
+        except (JobError, ValueError) as e:
+            return self._send(400, {"error": str(e)})
+        out = [j.as_dict() for j in jobs]
+        self._send(201, out if isinstance(body, list) else out[0])
+
+    def do_DELETE(self):
+        parts = [p for p in self.path.split("/") if p]
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self._job(parts)
+            return job and self._send(200, self.jobs.cancel(job.id).as_dict())
+        self._send(404, {"error": "not found"})
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(jobs: JobServer, host="127.0.0.1", port=JOB_SERVER_PORT, unix_path=None):
+    handler = type("Handler", (_Handler,), {"jobs": jobs})
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.unlink(unix_path)
+        return _UnixHTTPServer(unix_path, handler)
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    return srv
+
+def serve_in_thread(jobs: JobServer, host="127.0.0.1", port=0):
+    """Start a server on a background thread; returns (server, url)."""
+    srv = make_server(jobs, host, port)
+    threading.Thread(target=srv.serve_forever, name=f"http-{jobs.name}", daemon=True).start()
+    h, p = srv.server_address[:2]
+    return srv, f"http://{h}:{p}"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ECM drilling job server.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=JOB_SERVER_PORT)
+    ap.add_argument("--unix", default=None, help="listen on a Unix socket instead of TCP")
+    ap.add_argument("--name", default=None)
+    ap.add_argument("--sim", action="store_true", help="simulated hardware")
+    ap.add_argument("--time-scale", type=float, default=0.01, help="sim: real s per virtual s")
+    ap.add_argument("--recording", default=None, help="sim: replay sensor data from a recording")
+    ap.add_argument("--record", default=None, help="record each job for replay.py (PATH_<job>.jsonl)")
+    a = ap.parse_args(argv)
+
+    backend = SimBackend(a.time_scale, a.recording) if a.sim else HardwareBackend(a.record)
+    profiles.install_reload_handler()
+    jobs = JobServer(backend, a.name)
+    srv = make_server(jobs, a.host, a.port, a.unix)
+    where = a.unix or f"http://{a.host}:{a.port}"
+    print(f"[JOB] {jobs.name} {'(sim) ' if a.sim else ''}serving on {where} ({profiles.active().name})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[SYS] KeyboardInterrupt")
+    finally:
+        srv.server_close()
+        if not a.sim:
+            import RPi.GPIO as GPIO
+            GPIO.cleanup()
+            backend.close()
+        print("[SYS] Clean exit.")
+
+if __name__ == "__main__":
+    sys.exit(main())
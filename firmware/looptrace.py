@@ -0,0 +1,305 @@
+"""
+ECM Drill – Loop-timing tracer
+Low-overhead span/instant tracing for finding stutters (sleep overshoot, I2C
+reads, log-file opens, PWM thread). Each thread writes into its own
+preallocated ring buffer with monotonic nanosecond timestamps; nothing is
+allocated per event. Output is HDR-style latency histograms and Chrome /
+Perfetto trace JSON (open in https://ui.perfetto.dev or chrome://tracing).
+
+Switch at runtime, no restart needed:
+    looptrace.enable() / looptrace.disable()
+    kill -USR1 <pid>   → toggle tracing      (after install_signal_handlers())
+    kill -USR2 <pid>   → dump trace + histograms to LOG_DIR
+or start with ECM_TRACE=1 in the environment.
+
+Instrumenting:
+    @looptrace.traced("motion.move_mm")
+    def move_mm(...): ...
+
+    with looptrace.span("pump.sweep"):
+        ...
+    looptrace.instant("safety.relay_off")
+"""
+import functools, json, math, os, signal, threading, time
+from array import array
+
+from config import LOG_DIR, TRACE_ENABLED, TRACE_BUFFER_EVENTS
+
+_now = time.monotonic_ns
+
+class _State:
+    on = bool(TRACE_ENABLED) or os.environ.get("ECM_TRACE", "") not in ("", "0")
+
+_state = _State()
+
+def enable():
+    _state.on = True
+
+def disable():
+    _state.on = False
+
+def enabled() -> bool:
+    return _state.on
+
+def toggle() -> bool:
+    _state.on = not _state.on
+    return _state.on
+
+# ---- name interning ----
+_names = []
+_name_ids = {}
+_names_lock = threading.Lock()
+
+def _intern(name: str) -> int:
+    i = _name_ids.get(name)
+    if i is None:
+        with _names_lock:
+            i = _name_ids.get(name)
+            if i is None:
+                i = len(_names)
+                _names.append(name)
+                _name_ids[name] = i
+    return i
+
+# ---- per-thread ring buffers ----
+class _Buffer:
+    __slots__ = ("cap", "mask", "n", "ts", "dur", "name", "val", "tid", "thread_name")
+
+    def __init__(self, cap: int):
+        cap = 1 << max(4, (int(cap) - 1).bit_length())   # power of two
+        self.cap = cap
+        self.mask = cap - 1
+        self.n = 0                                      # total events written
+        self.ts = array("q", bytes(8 * cap))
+        self.dur = array("q", bytes(8 * cap))           # −1 → instant
+        self.name = array("i", bytes(4 * cap))
+        self.val = array("d", bytes(8 * cap))
+        t = threading.current_thread()
+        self.tid = threading.get_native_id()
+        self.thread_name = t.name
+
+    def add(self, name_id: int, ts: int, dur: int, val: float = 0.0):
+        i = self.n & self.mask
+        self.ts[i] = ts
+        self.dur[i] = dur
+        self.name[i] = name_id
+        self.val[i] = val
+        self.n += 1
+
+    def events(self):
+        """Yield (name_id, ts, dur, val) oldest first."""
+        start = max(0, self.n - self.cap)
+        for k in range(start, self.n):
+            i = k & self.mask
+            yield self.name[i], self.ts[i], self.dur[i], self.val[i]
+
+_tls = threading.local()
+_buffers = []
+_buffers_lock = threading.Lock()
+
+def _buf() -> _Buffer:
+    b = getattr(_tls, "buf", None)
+    if b is None:
+        b = _Buffer(TRACE_BUFFER_EVENTS)
+        _tls.buf = b
+        with _buffers_lock:
+            _buffers.append(b)
+    return b
+
+def clear():
+    with _buffers_lock:
+        for b in _buffers:
+            b.n = 0
+
+# ---- recording API ----
+class _Span:
+    __slots__ = ("nid", "t0")
+
+    def __init__(self, nid: int):
+        self.nid = nid
+
+    def __enter__(self):
+        self.t0 = _now()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = _now()
+        _buf().add(self.nid, self.t0, t1 - self.t0)
+
+class _NullSpan:
+    __slots__ = ()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullSpan()
+
+def span(name: str):
+    """Context manager timing a block (no-op while tracing is off)."""
+    if not _state.on:
+        return _NULL
+    return _Span(_intern(name))
+
+def instant(name: str, value: float = 0.0):
+    if _state.on:
+        _buf().add(_intern(name), _now(), -1, value)
+
+def traced(name: str = None):
+    """Decorator: record a span per call. Costs one attribute check while off."""
+    def deco(fn):
+        nid = _intern(name or f"{fn.__module__}.{fn.__qualname__}")
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.on:
+                return fn(*args, **kwargs)
+            t0 = _now()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _buf().add(nid, t0, _now() - t0)
+        return wrapper
+    return deco
+
+# ---- histograms ----
+class Histogram:
+    """
+    HDR-style log-linear histogram: values are bucketed by power of two and
+    each power split into 2**sub_bits linear sub-buckets (~3 % error at 5 bits).
+    """
+    def __init__(self, sub_bits: int = 5):
+        self.sub_bits = sub_bits
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, v: int) -> int:
+        if v < (1 << self.sub_bits):
+            return v
+        shift = v.bit_length() - 1 - self.sub_bits
+        return ((shift + 1) << self.sub_bits) + (v >> shift) - (1 << self.sub_bits)
+
+    def _value(self, idx: int) -> int:
+        """Upper edge of bucket idx."""
+        if idx < (1 << self.sub_bits):
+            return idx
+        shift = (idx >> self.sub_bits) - 1
+        sub = (idx & ((1 << self.sub_bits) - 1)) + (1 << self.sub_bits)
+        return ((sub + 1) << shift) - 1
+
+    def record(self, v: int):
+        v = max(0, int(v))
+        idx = self._index(v)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.total += 1
+        self.sum += v
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = max(self.max, v)
+
+    def percentile(self, p: float) -> int:
+        if not self.total:
+            return 0
+        want = max(1, math.ceil(self.total * p / 100.0))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= want:
+                return min(self._value(idx), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.total,
+            "min_us": (self.min or 0) / 1e3,
+            "mean_us": (self.sum / self.total / 1e3) if self.total else 0.0,
+            "p50_us": self.percentile(50) / 1e3,
+            "p90_us": self.percentile(90) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "p999_us": self.percentile(99.9) / 1e3,
+            "max_us": self.max / 1e3,
+        }
+
+def _snapshot():
+    with _buffers_lock:
+        bufs = list(_buffers)
+    return bufs, list(_names)
+
+def histograms() -> dict:
+    """name → Histogram of span durations (ns) across all threads."""
+    bufs, names = _snapshot()
+    out = {}
+    for b in bufs:
+        for nid, _ts, dur, _v in b.events():
+            if dur >= 0:
+                h = out.get(names[nid])
+                if h is None:
+                    h = out[names[nid]] = Histogram()
+                h.record(dur)
+    return out
+
+def report(file=None):
+    hs = histograms()
+    if not hs:
+        print("[TRACE] no spans recorded", file=file)
+        return
+    print(f"[TRACE] {'span':<28} {'count':>7} {'p50us':>9} {'p90us':>9} {'p99us':>9} {'maxus':>10}", file=file)
+    for name in sorted(hs):
+        s = hs[name].summary()
+        print(f"[TRACE] {name:<28} {s['count']:>7} {s['p50_us']:>9.1f} {s['p90_us']:>9.1f} "
+              f"{s['p99_us']:>9.1f} {s['max_us']:>10.1f}", file=file)
+
+def chrome_trace() -> dict:
+    """Chrome/Perfetto trace-event JSON object."""
+    bufs, names = _snapshot()
+    pid = os.getpid()
+    ev = []
+    for b in bufs:
+        ev.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": b.tid,
+                   "args": {"name": b.thread_name}})
+        for nid, ts, dur, val in b.events():
+            e = {"name": names[nid], "pid": pid, "tid": b.tid, "ts": ts / 1e3}
+            if dur >= 0:
+                e["ph"] = "X"
+                e["dur"] = dur / 1e3
+            else:
+                e["ph"] = "i"
+                e["s"] = "t"
+                if val:
+                    e["args"] = {"value": val}
+            ev.append(e)
+    return {"traceEvents": ev, "displayTimeUnit": "ns"}
+
+def export_chrome(path: str = None) -> str:
+    if path is None:
+        path = os.path.join(LOG_DIR, time.strftime("trace_%Y%m%d_%H%M%S.json"))
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(chrome_trace(), f)
+    return path
+
+def dump():
+    path = export_chrome()
+    report()
+    print(f"[TRACE] wrote {path}")
+    return path
+
+def _dump_safe():
+    try:
+        dump()
+    except Exception as e:
+        print(f"[TRACE] dump failed: {e}")
+
+def install_signal_handlers():
+    """SIGUSR1 toggles tracing, SIGUSR2 dumps. Call from the main thread.
+    The dump runs on its own thread: it takes _buffers_lock, which the
+    interrupted code may hold."""
+    def _toggle(_s, _f):
+        print(f"\n[TRACE] {'ON' if toggle() else 'OFF'}")
+    def _dump(_s, _f):
+        threading.Thread(target=_dump_safe, name="trace-dump", daemon=True).start()
+    signal.signal(signal.SIGUSR1, _toggle)
+    signal.signal(signal.SIGUSR2, _dump)
@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
-import os, csv, time, signal, sys
+import argparse, time, signal, sys
 import RPi.GPIO as GPIO
 
-from config import (LOG_DIR, LOG_FILE, MAX_FEED_MM_S, HOME_FEED_MM_S, PUMP_DUTY_RUN)
+from config import (MAX_FEED_MM_S, HOME_FEED_MM_S, PUMP_DUTY_RUN)
+from catalog import Catalog
+from flow import estimator_for
 from motion import MotionController
 from pump import PumpController
+from recorder import Recorder
 from safety import SafetyManager
 from sensors import Instrumentation
+import looptrace
+import profiles
 
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
@@ -17,7 +22,7 @@ def volume_target_mm3():
     return 0.25*3.141592653589793*(D**2)*TARGET_DEPTH_MM
 
 # graceful exit
-def _cleanup_and_exit(mc, pc):
+def _safe_hardware(mc, pc):
     try:
         mc.set_enabled(False)
     except Exception:
@@ -30,39 +35,43 @@ def _cleanup_and_exit(mc, pc):
         GPIO.cleanup()
     except Exception:
         pass
-    print("\n[SYS] Clean exit.")
-    sys.exit(0)
 
 def _sigint_handler(sig, frame):
     raise KeyboardInterrupt
 
 signal.signal(signal.SIGINT, _sigint_handler)
 
-def ensure_log():
-    os.makedirs(LOG_DIR, exist_ok=True)
-    path = os.path.join(LOG_DIR, LOG_FILE)
-    if not os.path.exists(path):
-        with open(path, "w", newline="") as f:
-            w = csv.writer(f)
-            w.writerow(["ts", "state", "ecm_V", "ecm_I_mA", "pump_I_mA", "pump_Lmin", "note"])
-    return path
-
-def log_row(path, state, instr, pump_Lmin=0.0, note=""):
+@looptrace.traced("main.log_row")
+def log_row(run, state, instr, pump_Lmin=0.0, note=""):
     snap = instr.snapshot()
     eV = round(snap.get("ecm_bus_V", 0.0), 3)
     eI = round(snap.get("ecm_I_mA", 0.0), 1)
     pI = round(snap.get("pump_I_mA", 0.0), 1)
-    with open(path, "a", newline="") as f:
-        csv.writer(f).writerow([time.time(), state, eV, eI, pI, round(pump_Lmin, 3), note])
+    run.sample(state, ecm_V=eV, ecm_I_mA=eI, pump_I_mA=pI, pump_Lmin=round(pump_Lmin, 3), note=note)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ECM drill bring-up: home, jog, pump sweep, feed demo.")
+    ap.add_argument("--record", default=None, help="record the run for replay.py (JSON lines)")
+    a = ap.parse_args(argv)
 
-def main():
     print("[SYS] Bring-up – starting")
-    log_path = ensure_log()
+    catalog = Catalog()
+    sweep = (20, 40, 60, 80, 100, 0)
+    # no single pump duty: the sweep range goes in the run metrics, each sample's state names its duty
+    run = catalog.start_run("bringup", note="main.py bring-up")
+    looptrace.install_signal_handlers()
+    profiles.install_reload_handler()
+    print(f"[SYS] Profile {profiles.active().name}")
 
     safety = SafetyManager()
     motion = MotionController()
     pump   = PumpController()
     instr  = Instrumentation(use_pump_sensor=True)
+    pump.flow = estimator_for(instr)     # None until `flow.py calibrate` has run
+    rec    = None
+    if a.record:                         # no touch-off in bring-up, so no surface mark
+        rec = Recorder(a.record, note="main.py bring-up")
+        motion, pump, instr = rec.wrap(motion, pump, instr)
 
     # Power path relay stays off until user is ready
     print("[SAFETY] Ensure E-STOP released to arm relay.")
@@ -79,24 +88,27 @@ def main():
         motion.move_mm(-3.0, HOME_FEED_MM_S)
 
         # ---- Pump test sweep ----
-        for duty in (20, 40, 60, 80, 100, 0):
+        for duty in sweep:
             pump.set_duty(duty)
             time.sleep(2.0)
-            # no flow sensor installed → always 0.0
-            log_row(log_path, f"pump_duty_{duty}", instr, pump_Lmin=0.0, note="pump sweep")
+            # no flow sensor installed → estimated from pump current (0.0 if uncalibrated)
+            log_row(run, f"pump_duty_{duty}", instr, pump_Lmin=pump.liters_per_min(), note="pump sweep")
             print(f"[PUMP] duty={duty:>3}%")
 
         # ---- Feed move with pump running ----
         pump.set_duty(PUMP_DUTY_RUN)
         motion.move_mm(+2.0, 1.0)  # demo feed
         motion.move_mm(-2.0, 1.0)
-        log_row(log_path, "feed_demo", instr, pump_Lmin=0.0, note="2mm up/down")
+        log_row(run, "feed_demo", instr, pump_Lmin=pump.liters_per_min(),
+                note=f"2mm up/down, pump {PUMP_DUTY_RUN}%")
 
         # idle
         pump.off()
         motion.set_enabled(False)
         safety.relay_off()
 
+        for name, d in instr.bus_stats().get("devices", {}).items():
+            print(f"[I2C] {name}: {d['reads_per_s']:.0f} reads/s, error rate {100*d['error_rate']:.1f}%")
         print("[SYS] Bring-up script finished OK.")
 
     except KeyboardInterrupt:
@@ -104,7 +116,23 @@ def main():
     except Exception as e:
         print(f"[ERR] {e}")
     finally:
-        _cleanup_and_exit(motion, pump)
+        _safe_hardware(motion, pump)     # driver and pump off before any file I/O
+        try:
+            run.finish(pump_duties=list(sweep))
+            catalog.close()
+        except Exception as e:
+            print(f"[ERR] catalog: {e}")
+        if rec is not None:
+            rec.close()
+        for c in (motion, pump, instr):
+            c.close()
+        if looptrace.enabled():
+            try:
+                looptrace.dump()
+            except Exception as e:
+                print(f"[ERR] loop trace dump: {e}")
+        print("\n[SYS] Clean exit.")
+        sys.exit(0)
 
 if __name__ == "__main__":
     main()
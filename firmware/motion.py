@@ -1,8 +1,9 @@
 import time
 import RPi.GPIO as GPIO
-from config import (STEP_PIN, DIR_PIN, EN_PIN, LIMIT_TOP_PIN, LIMIT_BOT_PIN,
-                    STEPS_PER_MM, MAX_FEED_MM_S, MIN_FEED_MM_S, DEBOUNCE_MS,
-                    HOME_DIR_UP, HOME_FEED_MM_S, HOME_BACKOFF_MM)
+import looptrace
+import profiles
+from config import (STEP_PIN, DIR_PIN, EN_PIN, LIMIT_TOP_PIN, LIMIT_BOT_PIN, DEBOUNCE_MS)
+from steploop import Guard, GuardSet, run_steps   # re-exported for existing importers
 
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
@@ -13,14 +14,24 @@ for p in (STEP_PIN, DIR_PIN, EN_PIN):
 for p in (LIMIT_TOP_PIN, LIMIT_BOT_PIN):
     GPIO.setup(p, GPIO.IN, pull_up_down=GPIO.PUD_UP)  # NC → LOW when pressed
 
-def _clamp_feed(feed_mm_s):
-    return max(MIN_FEED_MM_S, min(MAX_FEED_MM_S, float(feed_mm_s)))
-
 class MotionController:
-    def __init__(self):
+    def __init__(self, profile: profiles.Profile = None):
+        """profile=None → follow profiles.active(), including runtime switches."""
+        self.profile = profile or profiles.active()
+        self._unsubscribe = profiles.subscribe(self.set_profile) if profile is None else None
         self.enabled = False
         self.set_enabled(False)
 
+    def set_profile(self, profile: profiles.Profile):
+        """Takes effect from the next move."""
+        self.profile = profile
+
+    def close(self):
+        """Stop following profile switches."""
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+
     # ---- enable/disable driver ----
     def set_enabled(self, en: bool):
         # TMC2209 EN is active LOW
@@ -39,66 +50,68 @@ class MotionController:
     def _dir_up(self, up: bool):
         GPIO.output(DIR_PIN, GPIO.HIGH if up else GPIO.LOW)
 
-    def step_pulses(self, pulses: int, feed_mm_s: float):
+    def limit_guard(self, up: bool) -> Guard:
+        """Inline guard for the limit in the direction of travel."""
+        return Guard("top_limit" if up else "bot_limit",
+                     self.top_limit if up else self.bot_limit,
+                     message="[MOTION] Limit hit; stopping move.")
+
+    @looptrace.traced("motion.step_pulses")
+    def step_pulses(self, pulses: int, feed_mm_s: float, guards=()) -> int:
         """Generate a given number of step pulses at a target feed (mm/s)."""
-        feed = _clamp_feed(feed_mm_s)
-        step_hz = feed * STEPS_PER_MM         # pulses per second
-        if step_hz <= 0:
-            return
-        delay = 1.0 / (2.0 * step_hz)         # half-period
-
-        for _ in range(int(pulses)):
-            GPIO.output(STEP_PIN, GPIO.HIGH)
-            time.sleep(delay)
-            GPIO.output(STEP_PIN, GPIO.LOW)
-            time.sleep(delay)
-
-    def move_mm(self, mm: float, feed_mm_s: float):
-        """Blocking move by mm (+up / −down). Stops if limit is hit."""
+        p = self.profile
+        return run_steps(int(pulses), p.step_hz(feed_mm_s), GuardSet(*guards) if guards else None,
+                         half_s=p.half_period_s(feed_mm_s))
+
+    @looptrace.traced("motion.move_mm")
+    def move_mm(self, mm: float, feed_mm_s: float, guards=()) -> int:
+        """Blocking move by mm (+up / −down). Stops if limit (or any extra guard) trips."""
         if mm == 0:
-            return
+            return 0
+        p = self.profile
         up = (mm > 0)
         self._dir_up(up)
-        steps = int(abs(mm) * STEPS_PER_MM)
-        feed = _clamp_feed(feed_mm_s)
-        step_hz = feed * STEPS_PER_MM
-        delay = 1.0 / (2.0 * step_hz)
-
-        for _ in range(steps):
-            if (up and self.top_limit()) or ((not up) and self.bot_limit()):
-                print("[MOTION] Limit hit; stopping move.")
-                break
-            GPIO.output(STEP_PIN, GPIO.HIGH)
-            time.sleep(delay)
-            GPIO.output(STEP_PIN, GPIO.LOW)
-            time.sleep(delay)
+        gs = GuardSet(self.limit_guard(up), *guards)
+        moved = run_steps(p.steps(mm), p.step_hz(feed_mm_s), gs, half_s=p.half_period_s(feed_mm_s))
+        if gs.tripped:
+            print(gs.reason)
+        return moved
 
     # ---- homing routine ----
-    def home(self):
-        """Seek the top limit (by default), back off, and re-approach slowly."""
+    def _seek_home(self, feed_mm_s: float, guards=()) -> bool:
+        """Step toward the home limit until it trips; False if an extra guard stopped it first."""
+        p = self.profile
+        up = p.machine.home_dir_up
+        limit = self.limit_guard(up)
+        self._dir_up(up)
+        gs = GuardSet(limit, *guards)
+        run_steps(None, p.step_hz(feed_mm_s), gs, half_s=p.half_period_s(feed_mm_s))
+        return limit.evaluate() is not None
+
+    @looptrace.traced("motion.home")
+    def home(self, guards=()) -> bool:
+        """Seek the top limit (by default), back off, and re-approach slowly.
+        Extra guards (E-stop, a stop request) abort it: returns False, position unknown."""
+        p = self.profile
+        m = p.machine
         print("[MOTION] Homing...")
         self.set_enabled(True)
 
         # 1) approach
-        self._dir_up(HOME_DIR_UP)
-        while True:
-            if (HOME_DIR_UP and self.top_limit()) or ((not HOME_DIR_UP) and self.bot_limit()):
-                break
-            GPIO.output(STEP_PIN, GPIO.HIGH); time.sleep(0.001)
-            GPIO.output(STEP_PIN, GPIO.LOW);  time.sleep(0.001)
+        if not self._seek_home(m.home_seek_feed_mm_s, guards):
+            print("[MOTION] Homing aborted.")
+            return False
 
         time.sleep(DEBOUNCE_MS / 1000.0)
 
         # 2) backoff
-        self._dir_up(not HOME_DIR_UP)
-        self.move_mm(HOME_BACKOFF_MM if HOME_DIR_UP else -HOME_BACKOFF_MM, HOME_FEED_MM_S)
+        self._dir_up(not m.home_dir_up)
+        self.move_mm(m.home_backoff_mm if m.home_dir_up else -m.home_backoff_mm, m.home_feed_mm_s, guards)
 
         # 3) slow re-approach
-        self._dir_up(HOME_DIR_UP)
-        while True:
-            if (HOME_DIR_UP and self.top_limit()) or ((not HOME_DIR_UP) and self.bot_limit()):
-                break
-            GPIO.output(STEP_PIN, GPIO.HIGH); time.sleep(0.002)
-            GPIO.output(STEP_PIN, GPIO.LOW);  time.sleep(0.002)
+        if not self._seek_home(m.home_slow_feed_mm_s, guards):
+            print("[MOTION] Homing aborted.")
+            return False
 
         print("[MOTION] Homed.")
+        return True
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Machine and material profiles
+A profile is one machine (mechanics, pump, INA219 channels) plus one
+workpiece material (Faraday removal constants). Both are typed and
+validated; compile_profile() folds them into an immutable Profile with the
+derived constants (STEPS_PER_MM, K_MM3_PER_COULOMB) and a step-timing
+table (feed → step_hz, half-period, at FEED_RES_MM_S) built once, so the
+controllers only look values up.
+
+The "bench" machine and "al6061" material come from config.py. More (or
+overriding) profiles can be listed in PROFILE_FILE:
+
+    {"machines":  {"bench-tr8x8": {"base": "bench", "lead_mm_per_rev": 8.0}},
+     "materials": {"ss304": {"atomic_weight_kg_per_mol": 0.05585, "valence": 2,
+                             "density_kg_per_m3": 7900, "current_efficiency": 0.85}}}
+
+Controllers built without an explicit profile follow the active one, so
+switch() (or SIGHUP, which re-reads PROFILE_FILE) changes machine or material
+without a restart; a move already in progress finishes on the old profile.
+
+Usage:
+    python3 profiles.py list
+    python3 profiles.py show bench steel
+"""
+import argparse, json, os, signal, sys, threading
+from dataclasses import dataclass, field, fields, asdict, replace
+
+import config
+from config import (MACHINE_PROFILE, MATERIAL, PROFILE_FILE, FEED_RES_MM_S, FARADAY_C_PER_MOL)
+
+class ProfileError(ValueError):
+    pass
+
+def _check_types(obj):
+    """Coerce ints to float fields and reject anything else of the wrong type."""
+    for f in fields(obj):
+        if not f.init:
+            continue
+        v = getattr(obj, f.name)
+        if f.type is float and isinstance(v, int) and not isinstance(v, bool):
+            object.__setattr__(obj, f.name, float(v))
+        elif not isinstance(v, f.type) or (f.type is int and isinstance(v, bool)):
+            raise ProfileError(f"{type(obj).__name__} {obj.name!r}: {f.name} must be "
+                               f"{f.type.__name__}, got {v!r}")
+
+def _require(cond: bool, obj, msg: str):
+    if not cond:
+        raise ProfileError(f"{type(obj).__name__} {obj.name!r}: {msg}")
+
+# ---- materials ----
+@dataclass(frozen=True)
+class Material:
+    name: str
+    atomic_weight_kg_per_mol: float
+    valence: int
+    density_kg_per_m3: float
+    current_efficiency: float = 0.90
+
+    def __post_init__(self):
+        _check_types(self)
+        _require(self.atomic_weight_kg_per_mol > 0, self, "atomic weight must be > 0")
+        _require(self.valence >= 1, self, "valence must be ≥ 1")
+        _require(self.density_kg_per_m3 > 0, self, "density must be > 0")
+        _require(0.0 < self.current_efficiency <= 1.0, self, "current efficiency must be in (0, 1]")
+
+    @property
+    def k_mm3_per_coulomb(self) -> float:
+        """Faraday removal per coulomb (mm³/C)."""
+        return (self.current_efficiency * self.atomic_weight_kg_per_mol
+                / (self.valence * FARADAY_C_PER_MOL * self.density_kg_per_m3)) * 1e9
+
+MATERIALS = {
+    "al6061": Material("al6061", config.ATOMIC_WEIGHT_KG_PER_MOL, config.VALENCE_Z,
+                       config.DENSITY_KG_PER_M3, config.CURRENT_EFFICIENCY),
+    "steel":  Material("steel", 0.05585, 2, 7850.0, 0.95),       # mild steel, Fe → Fe²⁺ in NaCl
+}
+
+# ---- machines ----
+@dataclass(frozen=True)
+class Machine:
+    name: str
+    steps_per_rev: int = config.STEPS_PER_REV
+    microstep: int = config.MICROSTEP
+    lead_mm_per_rev: float = config.LEAD_MM_PER_REV
+    max_feed_mm_s: float = config.MAX_FEED_MM_S
+    min_feed_mm_s: float = config.MIN_FEED_MM_S
+    home_dir_up: bool = config.HOME_DIR_UP
+    home_feed_mm_s: float = config.HOME_FEED_MM_S
+    home_backoff_mm: float = config.HOME_BACKOFF_MM
+    home_seek_feed_mm_s: float = config.HOME_SEEK_FEED_MM_S
+    home_slow_feed_mm_s: float = config.HOME_SLOW_FEED_MM_S
+    pump_pwm_hz: float = config.PUMP_PWM_HZ
+    pump_duty_idle: float = config.PUMP_DUTY_IDLE
+    pump_duty_run: float = config.PUMP_DUTY_RUN
+    ina_ecm_addr: int = config.INA_ECM_ADDR
+    ina_pump_addr: int = config.INA_PUMP_ADDR
+    ecm_shunt_ohms: float = config.ECM_SHUNT_OHMS
+    pump_shunt_ohms: float = config.PUMP_SHUNT_OHMS
+    ecm_invert_sign: bool = config.ECM_INVERT_SIGN
+    pump_invert_sign: bool = config.PUMP_INVERT_SIGN
+    ecm_i_offset_mA: float = config.ECM_I_OFFSET_MA
+    pump_i_offset_mA: float = config.PUMP_I_OFFSET_MA
+    current_ema_alpha: float = config.CURRENT_EMA_ALPHA
+    tool_diameter_mm: float = config.TOOL_DIAMETER_MM
+
+    def __post_init__(self):
+        _check_types(self)
+        _require(self.steps_per_rev > 0 and self.microstep > 0, self, "steps/rev and microstep must be > 0")
+        _require(self.lead_mm_per_rev > 0, self, "lead must be > 0")
+        _require(0 < self.min_feed_mm_s <= self.max_feed_mm_s, self, "need 0 < min feed ≤ max feed")
+        for k in ("home_feed_mm_s", "home_seek_feed_mm_s", "home_slow_feed_mm_s"):
+            _require(self.min_feed_mm_s <= getattr(self, k) <= self.max_feed_mm_s, self,
+                     f"{k} outside the feed range")
+        _require(self.home_backoff_mm > 0, self, "home backoff must be > 0")
+        _require(self.pump_pwm_hz > 0, self, "pump PWM frequency must be > 0")
+        for k in ("pump_duty_idle", "pump_duty_run"):
+            _require(0.0 <= getattr(self, k) <= 100.0, self, f"{k} must be in [0, 100]")
+        for k in ("ina_ecm_addr", "ina_pump_addr"):
+            _require(0x40 <= getattr(self, k) <= 0x4F, self, f"{k} must be an INA219 address (0x40–0x4F)")
+        _require(self.ina_ecm_addr != self.ina_pump_addr, self, "ECM and pump INA219 share an address")
+        _require(self.ecm_shunt_ohms > 0 and self.pump_shunt_ohms > 0, self, "shunts must be > 0 Ω")
+        _require(0.0 <= self.current_ema_alpha <= 1.0, self, "EMA alpha must be in [0, 1]")
+        _require(self.tool_diameter_mm > 0, self, "tool diameter must be > 0")
+
+MACHINES = {"bench": Machine("bench")}
+
+# ---- compiled profile ----
+@dataclass(frozen=True)
+class Profile:
+    machine: Machine
+    material: Material
+    feed_res_mm_s: float = FEED_RES_MM_S
+    # derived, filled in by __post_init__
+    steps_per_mm: int = field(init=False)
+    k_mm3_per_coulomb: float = field(init=False)
+    _hz: tuple = field(init=False, repr=False, compare=False)
+    _half: tuple = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        m = self.machine
+        spm = int(m.steps_per_rev * m.microstep / m.lead_mm_per_rev)
+        if spm <= 0:
+            raise ProfileError(f"machine {m.name!r}: less than one step per mm")
+        n = int(round((m.max_feed_mm_s - m.min_feed_mm_s) / self.feed_res_mm_s)) + 1
+        hz = tuple(min(m.min_feed_mm_s + k * self.feed_res_mm_s, m.max_feed_mm_s) * spm for k in range(n))
+        put = lambda k, v: object.__setattr__(self, k, v)
+        put("steps_per_mm", spm)
+        put("k_mm3_per_coulomb", self.material.k_mm3_per_coulomb)
+        put("_hz", hz)
+        put("_half", tuple(0.5 / h for h in hz))
+
+    @property
+    def name(self) -> str:
+        return f"{self.machine.name}/{self.material.name}"
+
+    # ---- hot-path lookups ----
+    def _index(self, feed_mm_s: float) -> int:
+        k = int((float(feed_mm_s) - self.machine.min_feed_mm_s) / self.feed_res_mm_s + 0.5)
+        return 0 if k < 0 else min(k, len(self._hz) - 1)
+
+    def clamp_feed(self, feed_mm_s: float) -> float:
+        return self._hz[self._index(feed_mm_s)] / self.steps_per_mm
+
+    def step_hz(self, feed_mm_s: float) -> float:
+        """STEP rate for a feed, clamped to the machine's feed range."""
+        return self._hz[self._index(feed_mm_s)]
+
+    def half_period_s(self, feed_mm_s: float) -> float:
+        return self._half[self._index(feed_mm_s)]
+
+    def steps(self, mm: float) -> int:
+        return int(abs(mm) * self.steps_per_mm)
+
+    def as_dict(self) -> dict:
+        return {"name": self.name, "machine": asdict(self.machine), "material": asdict(self.material),
+                "steps_per_mm": self.steps_per_mm, "k_mm3_per_coulomb": self.k_mm3_per_coulomb}
+
+# ---- loading ----
+def _file_path(path: str = None) -> str:
+    path = path or PROFILE_FILE
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+def load_file(path: str = None):
+    """(machines, materials) from the built-ins plus PROFILE_FILE, if present."""
+    machines, materials = dict(MACHINES), dict(MATERIALS)
+    p = _file_path(path)
+    if not os.path.exists(p):
+        return machines, materials
+    try:
+        with open(p) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ProfileError(f"{p}: {e}")
+    if not isinstance(data, dict):
+        raise ProfileError(f"{p}: top level must be an object with machines / materials")
+    for table, cls in ((materials, Material), (machines, Machine)):
+        key = "machines" if cls is Machine else "materials"
+        specs = data.get(key) or {}
+        if not isinstance(specs, dict):
+            raise ProfileError(f"{p}: {key} must be an object of name → spec")
+        for name, spec in specs.items():
+            if not isinstance(spec, dict):
+                raise ProfileError(f"{key} {name!r}: spec must be an object")
+            spec = dict(spec)
+            base = spec.pop("base", None)
+            try:
+                if base is not None:
+                    if base not in table:
+                        raise ProfileError(f"{key} {name!r}: unknown base {base!r}")
+                    table[name] = replace(table[base], name=name, **spec)
+                else:
+                    table[name] = cls(name=name, **spec)
+            except TypeError as e:          # unknown / missing field, unhashable base
+                raise ProfileError(f"{key} {name!r}: {e}")
+    return machines, materials
+
+def compile_profile(machine: str = MACHINE_PROFILE, material: str = MATERIAL, path: str = None) -> Profile:
+    machines, materials = load_file(path)
+    if machine not in machines:
+        raise ProfileError(f"unknown machine {machine!r} (have: {', '.join(sorted(machines))})")
+    if material not in materials:
+        raise ProfileError(f"unknown material {material!r} (have: {', '.join(sorted(materials))})")
+    return Profile(machines[machine], materials[material])
+
+# ---- active profile ----
+_ACTIVE = None
+_LOCK = threading.Lock()
+_SUBSCRIBERS = []
+
+def active() -> Profile:
+    """The process-wide profile (config.py selection until switch() is called)."""
+    global _ACTIVE
+    with _LOCK:
+        if _ACTIVE is None:
+            _ACTIVE = compile_profile()
+        return _ACTIVE
+
+def subscribe(fn):
+    """Call fn(profile) after every switch(). Returns a no-argument unsubscribe handle."""
+    with _LOCK:
+        _SUBSCRIBERS.append(fn)
+    return lambda: unsubscribe(fn)
+
+def unsubscribe(fn):
+    with _LOCK:
+        if fn in _SUBSCRIBERS:
+            _SUBSCRIBERS.remove(fn)
+
+def switch(machine: str = None, material: str = None, path: str = None) -> Profile:
+    """Compile and activate a new profile; None keeps the current machine/material.
+    Raises ProfileError (leaving the active profile unchanged) if it does not validate."""
+    global _ACTIVE
+    cur = active()
+    p = compile_profile(machine or cur.machine.name, material or cur.material.name, path)
+    with _LOCK:
+        _ACTIVE = p
+        subs = list(_SUBSCRIBERS)
+    for fn in subs:
+        fn(p)
+    print(f"[PROFILE] {p.name}: {p.steps_per_mm} steps/mm, K={p.k_mm3_per_coulomb:.5f} mm³/C")
+    return p
+
+def _reload():
+    try:
+        switch()
+    except ProfileError as e:
+        print(f"[PROFILE] reload failed, keeping {active().name}: {e}")
+
+def install_reload_handler():
+    """SIGHUP re-reads PROFILE_FILE and re-activates the current selection. Call from the main thread.
+    The handler only starts a thread: switch() takes _LOCK, which the interrupted code may hold."""
+    def _on_hup(_s, _f):
+        threading.Thread(target=_reload, name="profile-reload", daemon=True).start()
+    signal.signal(signal.SIGHUP, _on_hup)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="List, validate and show machine/material profiles.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    p = sub.add_parser("show")
+    p.add_argument("machine", nargs="?", default=MACHINE_PROFILE)
+    p.add_argument("material", nargs="?", default=MATERIAL)
+    a = ap.parse_args(argv)
+    try:
+        if a.cmd == "list":
+            machines, materials = load_file()
+            print("[PROFILE] machines: " + ", ".join(sorted(machines)))
+            for name, m in sorted(materials.items()):
+                print(f"[PROFILE] material {name:<10} K={m.k_mm3_per_coulomb:.5f} mm³/C")
+        else:
+            print(json.dumps(compile_profile(a.machine, a.material).as_dict(), indent=1))
+    except ProfileError as e:
+        print(f"[ERR] {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
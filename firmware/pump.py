@@ -1,5 +1,6 @@
 import RPi.GPIO as GPIO
-from config import (PUMP_PWM_PIN, PUMP_PWM_HZ, PUMP_DUTY_IDLE, PUMP_DUTY_RUN)
+import profiles
+from config import (PUMP_PWM_PIN, PUMP_PWM_HZ)
 
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
@@ -8,20 +9,48 @@ GPIO.setup(PUMP_PWM_PIN, GPIO.OUT, initial=GPIO.LOW)
 _pwm = GPIO.PWM(PUMP_PWM_PIN, PUMP_PWM_HZ)
 
 class PumpController:
-    def __init__(self):
+    def __init__(self, flow=None, profile: profiles.Profile = None):
+        """profile=None → follow profiles.active(), including runtime switches."""
+        self.flow = flow            # flow.FlowEstimator, if the pump is calibrated
+        self.profile = None
+        self._hz = PUMP_PWM_HZ
         self._duty = 0.0
-        _pwm.start(PUMP_DUTY_IDLE)
+        self.set_profile(profile or profiles.active())
+        self._unsubscribe = profiles.subscribe(self.set_profile) if profile is None else None
+        self._duty = self.profile.machine.pump_duty_idle
+        _pwm.start(self._duty)
+
+    def set_profile(self, profile: profiles.Profile):
+        """New PWM frequency applies immediately; the current duty is kept."""
+        self.profile = profile
+        hz = profile.machine.pump_pwm_hz
+        if hz != self._hz:
+            _pwm.ChangeFrequency(hz)
+            self._hz = hz
+
+    def close(self):
+        """Stop following profile switches."""
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    @property
+    def duty(self) -> float:
+        return self._duty
 
     def set_duty(self, duty_percent: float):
         self._duty = max(0.0, min(100.0, float(duty_percent)))
         _pwm.ChangeDutyCycle(self._duty)
 
-    def on(self, duty_percent=PUMP_DUTY_RUN):
-        self.set_duty(duty_percent)
+    def on(self, duty_percent=None):
+        self.set_duty(self.profile.machine.pump_duty_run if duty_percent is None else duty_percent)
 
     def off(self):
         self.set_duty(0.0)
 
     # keep API compatible with main.py logs
     def liters_per_min(self) -> float:
-        return 0.0
+        """Estimated flow from pump current (flow.py); 0.0 when uncalibrated."""
+        if self.flow is None:
+            return 0.0
+        return self.flow.estimate(self._duty)
@@ -0,0 +1,192 @@
+"""
+ECM Drill – Run recorder
+Wraps MotionController / PumpController / Instrumentation and writes every
+sensor sample, motion command and pump duty change to a JSON-lines file with
+timestamps (seconds since recording start). Recordings are replayed offline
+by replay.py.
+
+z_mm is measured from home (the top limit). Call mark_surface() once the
+tool touches the work: samples then also carry depth_mm below the surface,
+which is what replay.py indexes on.
+
+Usage:
+    rec = Recorder("data/run_001.jsonl")
+    motion, pump, instr = rec.wrap(MotionController(), PumpController(), Instrumentation())
+    motion.home(); ...  # approach the work
+    rec.mark_surface()
+    ...  # use the wrapped objects exactly like the originals
+    rec.close()
+
+One recording holds one hole. Multi-hole runners (batch.py, jobserver.py)
+call rotate(hole_path(path, name)) before each hole: the proxies stay in
+place and the machine state carries over into the new file.
+"""
+import json, os, threading, time
+
+import config
+import profiles
+
+RECORDING_VERSION = 1
+
+def config_snapshot():
+    """Plain-value copy of config.py (upper-case names only) plus the active profile."""
+    out = {}
+    for k in dir(config):
+        if k.isupper():
+            v = getattr(config, k)
+            if isinstance(v, (int, float, str, bool)):
+                out[k] = v
+    p = profiles.active()
+    out["ACTIVE_PROFILE"] = p.name
+    out["STEPS_PER_MM"] = p.steps_per_mm
+    out["K_MM3_PER_COULOMB"] = p.k_mm3_per_coulomb
+    return out
+
+def hole_path(path: str, tag) -> str:
+    """data/run.jsonl, "A1" → data/run_A1.jsonl (one recording per hole)."""
+    root, ext = os.path.splitext(path)
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(tag)).strip("_")
+    return f"{root}_{safe}{ext or '.jsonl'}"
+
+class Recorder:
+    def __init__(self, path: str, clock=time.monotonic, note: str = ""):
+        self._clock = clock
+        self._lock = threading.Lock()   # safety callbacks arrive on the GPIO thread
+        self._f = None
+        # Machine state tracked so every sample carries its context
+        self.z_mm = 0.0
+        self.surface_z_mm = None        # z of the work surface, once marked
+        self.feed_mm_s = 0.0
+        self.duty = 0.0
+        self.rotate(path, note)
+
+    def rotate(self, path: str, note: str = ""):
+        """Close the current file and continue in `path` (new time origin, surface unmarked)."""
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        f = open(path, "w", buffering=1 << 16)
+        with self._lock:
+            if self._f:
+                self._f.close()
+            self._f = f
+            self.path = path
+            self._t0 = self._clock()
+            self.surface_z_mm = None
+        self.event("meta", version=RECORDING_VERSION, wall_ts=time.time(),
+                   note=note, config=config_snapshot())
+        self.event("pump", duty=self.duty)
+        print(f"[REC] Recording to {path}")
+
+    def now(self) -> float:
+        return self._clock() - self._t0
+
+    def event(self, kind: str, **fields):
+        fields["t"] = round(self.now(), 6)
+        fields["kind"] = kind
+        line = json.dumps(fields, separators=(",", ":"))
+        with self._lock:
+            if self._f:
+                self._f.write(line + "\n")
+
+    def mark_surface(self):
+        """The tool is at the work surface now; later samples get depth_mm below it."""
+        self.surface_z_mm = self.z_mm
+        self.event("surface", z_mm=round(self.z_mm, 4))
+
+    def sample(self, snap: dict):
+        extra = {}
+        if self.surface_z_mm is not None:
+            extra["depth_mm"] = round(self.surface_z_mm - self.z_mm, 4)
+        self.event("sample", z_mm=round(self.z_mm, 4), feed_mm_s=self.feed_mm_s,
+                   duty=self.duty, **extra, **snap)
+
+    def close(self):
+        with self._lock:
+            if self._f:
+                self._f.close()
+                self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def wrap(self, motion, pump, instr):
+        """Return recording proxies for (motion, pump, instr)."""
+        return (RecordingMotion(motion, self),
+                RecordingPump(pump, self),
+                RecordingInstrumentation(instr, self) if instr else None)
+
+class _Proxy:
+    def __init__(self, inner, rec: Recorder):
+        self._inner = inner
+        self._rec = rec
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+class RecordingMotion(_Proxy):
+    def __init__(self, inner, rec):
+        super().__init__(inner, rec)
+        self._up = True
+
+    def set_enabled(self, en: bool):
+        self._rec.event("motion", cmd="set_enabled", en=bool(en))
+        self._inner.set_enabled(en)
+
+    def _dir_up(self, up: bool):
+        self._up = bool(up)
+        self._inner._dir_up(up)
+
+    def step_pulses(self, pulses: int, feed_mm_s: float, guards=()):
+        rec = self._rec
+        rec.feed_mm_s = float(feed_mm_s)
+        rec.event("motion", cmd="step_pulses", pulses=int(pulses), up=self._up, feed=float(feed_mm_s))
+        out = self._inner.step_pulses(pulses, feed_mm_s, guards)
+        mm = (int(pulses) if out is None else out) / self._inner.profile.steps_per_mm
+        rec.z_mm += mm if self._up else -mm
+        rec.event("motion", cmd="done", z_mm=round(rec.z_mm, 4))
+        return out
+
+    def move_mm(self, mm: float, feed_mm_s: float, guards=()):
+        rec = self._rec
+        rec.feed_mm_s = float(feed_mm_s)
+        rec.event("motion", cmd="move_mm", mm=float(mm), feed=float(feed_mm_s))
+        if mm:
+            self._up = mm > 0           # the inner move sets DIR itself, not through this proxy
+        out = self._inner.move_mm(mm, feed_mm_s, guards)
+        if out is None:
+            rec.z_mm += float(mm)
+        else:   # steps actually taken (a guard may have stopped the move)
+            rec.z_mm += (out if mm > 0 else -out) / self._inner.profile.steps_per_mm
+        rec.event("motion", cmd="done", z_mm=round(rec.z_mm, 4))
+        return out
+
+    def home(self, guards=()):
+        rec = self._rec
+        rec.event("motion", cmd="home")
+        out = self._inner.home(guards)
+        self._up = self._inner.profile.machine.home_dir_up     # DIR left by the slow re-approach
+        rec.z_mm = 0.0
+        rec.event("motion", cmd="done", z_mm=0.0)
+        return out
+
+class RecordingPump(_Proxy):
+    def set_duty(self, duty_percent: float):
+        self._inner.set_duty(duty_percent)
+        self._rec.duty = max(0.0, min(100.0, float(duty_percent)))
+        self._rec.event("pump", duty=self._rec.duty)
+
+    def on(self, duty_percent=None):
+        self.set_duty(self._inner.profile.machine.pump_duty_run if duty_percent is None else duty_percent)
+
+    def off(self):
+        self.set_duty(0.0)
+
+class RecordingInstrumentation(_Proxy):
+    def snapshot(self):
+        snap = self._inner.snapshot()
+        self._rec.sample(snap)
+        return snap
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+ECM Drill – Replay engine and parameter sweep
+Feeds a recording (see recorder.py) back through control code against a
+virtual clock, so a drilling program runs far faster than real time and
+without hardware. A process pool replays one recording under many parameter
+sets and ranks them by simulated cycle time.
+
+Replayed ECM current is looked up by depth below the work surface and
+scaled by the feed ratio (at equilibrium gap the dissolution current is
+proportional to feed). Replay programs start with the tool at the surface.
+The surface comes from the recorder's mark_surface(); older recordings
+without one fall back to the first sample drawing REPLAY_CONTACT_FRAC of the
+peak ECM current.
+
+Usage:
+    python3 replay.py data/run_001.jsonl                      # default sweep
+    python3 replay.py data/run_001.jsonl --feeds 0.02,0.05,0.1 --duties 40,60,80
+    python3 replay.py data/run_001.jsonl --program peck --retracts 0.1,0.3,0.5
+"""
+import argparse, bisect, itertools, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+from config import (TARGET_DEPTH_MM, PUMP_DUTY_RUN, ECM_VOLTAGE_V,
+                    REPLAY_CONTACT_FRAC)
+from cycle import peck_program
+import profiles
+
+# ---- recording ----
+class Recording:
+    def __init__(self, events):
+        self.meta = {}
+        self.samples = []
+        self.commands = []
+        for e in events:
+            kind = e.get("kind")
+            if kind == "meta":
+                self.meta = e
+            elif kind == "sample":
+                self.samples.append(e)
+            else:
+                self.commands.append(e)
+        self.samples.sort(key=lambda s: s["t"])
+        self.surface_z_mm = self._find_surface()
+        # depth index: depth below the surface, positive into the work; pre-contact samples excluded
+        cut = [(self._depth(s), s) for s in self.samples]
+        cut = sorted((d, s) for d, s in cut if d >= 0.0) if cut else []
+        self._depths = [d for d, _s in cut]
+        self._by_depth = [s for _d, s in cut]
+        self._times = [s["t"] for s in self.samples]
+
+    def _find_surface(self):
+        for c in self.commands:
+            if c.get("kind") == "surface":
+                return c["z_mm"]
+        peak = max((s.get("ecm_I_mA") or 0.0 for s in self.samples
+                    if s.get("ecm_I_mA") == s.get("ecm_I_mA")), default=0.0)
+        if peak <= 0.0:
+            return 0.0
+        for s in self.samples:
+            i = s.get("ecm_I_mA")
+            if i is not None and i == i and i >= REPLAY_CONTACT_FRAC * peak:
+                return s.get("z_mm", 0.0)
+        return 0.0
+
+    def _depth(self, s) -> float:
+        if "depth_mm" in s:
+            return s["depth_mm"]
+        return self.surface_z_mm - s.get("z_mm", 0.0)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            return cls(json.loads(line) for line in f if line.strip())
+
+    @property
+    def duration_s(self) -> float:
+        last = self.commands[-1]["t"] if self.commands else 0.0
+        return max(last, self._times[-1] if self._times else 0.0)
+
+    def sample_at_time(self, t: float):
+        if not self.samples:
+            return None
+        i = bisect.bisect_right(self._times, t) - 1
+        return self.samples[max(0, i)]
+
+    def sample_at_depth(self, depth_mm: float):
+        """Recorded sample at `depth_mm` below the surface; None above the surface."""
+        if not self._by_depth or depth_mm < 0.0:
+            return None
+        i = bisect.bisect_right(self._depths, depth_mm) - 1
+        return self._by_depth[max(0, i)]
+
+    def home_duration_s(self) -> float:
+        """Time the recorded homing took; 0 if the run never homed."""
+        start = None
+        for c in self.commands:
+            if c.get("cmd") == "home":
+                start = c["t"]
+            elif start is not None and c.get("cmd") == "done":
+                return c["t"] - start
+        return 0.0
+
+# ---- virtual hardware ----
+class VirtualClock:
+    def __init__(self, t0: float = 0.0):
+        self.now = float(t0)
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, dt: float):
+        if dt > 0:
+            self.now += dt
+
+class ReplayMotion:
+    """MotionController look-alike; advances the virtual clock instead of sleeping."""
+    def __init__(self, clock: VirtualClock, home_s: float = 0.0, profile: profiles.Profile = None):
+        self.clock = clock
+        self.profile = profile or profiles.active()
+        self.enabled = False
+        self.z_mm = 0.0
+        self.feed_mm_s = 0.0
+        self.steps = 0
+        self._up = True
+        self._home_s = home_s
+
+    def set_enabled(self, en: bool):
+        self.enabled = en
+
+    @staticmethod
+    def top_limit():
+        return False
+
+    @staticmethod
+    def bot_limit():
+        return False
+
+    def _dir_up(self, up: bool):
+        self._up = up
+
+    def step_pulses(self, pulses: int, feed_mm_s: float, guards=()) -> int:
+        # guards are not evaluated: recorded samples are not re-read per step
+        p = self.profile
+        self.feed_mm_s = p.clamp_feed(feed_mm_s)
+        n = int(pulses)
+        self.clock.sleep(n / p.step_hz(feed_mm_s))
+        mm = n / p.steps_per_mm
+        self.z_mm += mm if self._up else -mm
+        self.steps += n
+        return n
+
+    def move_mm(self, mm: float, feed_mm_s: float, guards=()) -> int:
+        if mm == 0:
+            return 0
+        self._dir_up(mm > 0)
+        return self.step_pulses(self.profile.steps(mm), feed_mm_s, guards)
+
+    def home(self, guards=()) -> bool:
+        # guards are not evaluated, as in step_pulses
+        m = self.profile.machine
+        self.clock.sleep(self._home_s or (2 * m.home_backoff_mm / m.home_feed_mm_s))
+        self.z_mm = 0.0
+        return True
+
+class ReplayPump:
+    def __init__(self, clock: VirtualClock, profile: profiles.Profile = None):
+        self.clock = clock
+        self.profile = profile or profiles.active()
+        self._duty = 0.0
+        self.duty_s = 0.0        # ∫duty dt, for energy comparisons
+        self._t_last = clock.now
+
+    def _accumulate(self):
+        now = self.clock.now
+        self.duty_s += self._duty / 100.0 * (now - self._t_last)
+        self._t_last = now
+
+    def set_duty(self, duty_percent: float):
+        self._accumulate()
+        self._duty = max(0.0, min(100.0, float(duty_percent)))
+
+    def on(self, duty_percent=None):
+        self.set_duty(self.profile.machine.pump_duty_run if duty_percent is None else duty_percent)
+
+    def off(self):
+        self.set_duty(0.0)
+
+    @property
+    def duty(self) -> float:
+        return self._duty
+
+    def liters_per_min(self) -> float:
+        return 0.0
+
+class ReplayInstrumentation:
+    """Serves recorded samples by depth, ECM current scaled by feed ratio."""
+    def __init__(self, recording: Recording, motion: ReplayMotion):
+        self.rec = recording
+        self.motion = motion
+
+    def snapshot(self):
+        depth = -self.motion.z_mm          # replay starts with the tool at the surface (z = 0)
+        s = self.rec.sample_at_depth(depth)
+        if s is None:
+            return {"ecm_bus_V": 0.0, "ecm_shunt_V": 0.0, "ecm_I_mA": 0.0, "ecm_P_mW": 0.0}
+        snap = {k: v for k, v in s.items()
+                if k.startswith("ecm_") or k.startswith("pump_")}
+        rec_feed = s.get("feed_mm_s") or 0.0
+        if rec_feed > 0 and self.motion.feed_mm_s > 0 and "ecm_I_mA" in snap:
+            ratio = self.motion.feed_mm_s / rec_feed
+            snap["ecm_I_mA"] *= ratio
+            snap["ecm_P_mW"] = snap.get("ecm_P_mW", 0.0) * ratio
+        return snap
+
+class ModelInstrumentation:
+    """No recording: ECM current from Faraday's law at equilibrium gap (I = f·A/K)."""
+    def __init__(self, motion: ReplayMotion, voltage_V: float = ECM_VOLTAGE_V):
+        self.motion = motion
+        self.voltage_V = voltage_V
+        self._area_mm2 = 0.25 * 3.141592653589793 * motion.profile.machine.tool_diameter_mm ** 2
+        self._K = motion.profile.k_mm3_per_coulomb
+
+    def snapshot(self):
+        cutting = not self.motion._up and self.motion.feed_mm_s > 0
+        i_mA = self.motion.feed_mm_s * self._area_mm2 / self._K * 1000.0 if cutting else 0.0
+        return {"ecm_bus_V": self.voltage_V, "ecm_shunt_V": 0.0,
+                "ecm_I_mA": i_mA, "ecm_P_mW": i_mA * self.voltage_V}
+
+# ---- control programs ----
+DEFAULT_PARAMS = {
+    "feed_mm_s":  0.05,    # cutting feed
+    "chunk_mm":   0.05,    # depth per control tick
+    "pump_duty":  PUMP_DUTY_RUN,
+    "i_short_mA": 8000.0,  # treat as incipient short above this
+    "retract_mm": 0.2,
+    "backoff":    0.8,     # feed multiplier after a short
+    "depth_mm":   TARGET_DEPTH_MM,
+}
+
+def feed_to_depth(motion, pump, instr, clock, params):
+    """Feed down in chunks to depth; retract and slow down on over-current."""
+    p = dict(DEFAULT_PARAMS, **params)
+    feed = p["feed_mm_s"]
+    m = motion.profile.machine
+    shorts = 0
+    depth = 0.0
+    pump.set_duty(p["pump_duty"])
+    motion.set_enabled(True)
+    while depth < p["depth_mm"]:
+        chunk = min(p["chunk_mm"], p["depth_mm"] - depth)
+        motion.move_mm(-chunk, feed)
+        depth += chunk
+        i_mA = instr.snapshot().get("ecm_I_mA", 0.0)
+        if i_mA > p["i_short_mA"]:
+            shorts += 1
+            motion.move_mm(+p["retract_mm"], m.max_feed_mm_s)
+            motion.move_mm(-p["retract_mm"], m.max_feed_mm_s)
+            feed = max(m.min_feed_mm_s, feed * p["backoff"])
+            if shorts > 100:
+                break
+    pump.off()
+    motion.set_enabled(False)
+    return {"shorts": shorts, "depth_mm": depth, "final_feed_mm_s": feed,
+            "complete": depth >= p["depth_mm"]}
+
+PROGRAMS = {"feed_to_depth": feed_to_depth, "peck": peck_program}
+
+# ---- replay / sweep ----
+def replay(recording, params=None, program="feed_to_depth"):
+    """Run one program against a recording; return result dict with cycle_s."""
+    if isinstance(recording, str):
+        recording = Recording.load(recording)
+    fn = PROGRAMS[program] if isinstance(program, str) else program
+    clock = VirtualClock()
+    motion = ReplayMotion(clock, home_s=recording.home_duration_s())
+    pump = ReplayPump(clock)
+    instr = ReplayInstrumentation(recording, motion)
+    wall0 = time.perf_counter()
+    result = dict(fn(motion, pump, instr, clock, params or {}) or {})
+    pump._accumulate()
+    wall = time.perf_counter() - wall0
+    result.update({
+        "params": params or {},
+        "cycle_s": clock.now,
+        "pump_duty_s": pump.duty_s,
+        "speedup": clock.now / wall if wall > 0 else float("inf"),
+    })
+    return result
+
+_worker_rec = None
+
+def _init_worker(path):
+    global _worker_rec
+    _worker_rec = Recording.load(path)
+
+def _replay_worker(args):
+    params, program = args
+    return replay(_worker_rec, params, program)
+
+def sweep(path: str, param_sets, program="feed_to_depth", workers=None):
+    """Replay `path` under every params dict in parallel; rank by cycle time.
+    Incomplete runs sort last."""
+    param_sets = list(param_sets)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(path,)) as ex:
+        results = list(ex.map(_replay_worker, [(p, program) for p in param_sets],
+                              chunksize=max(1, len(param_sets) // (4 * (os.cpu_count() or 1)))))
+    results.sort(key=lambda r: (not r.get("complete", True), r["cycle_s"]))
+    return results
+
+def grid(**axes):
+    """grid(feed_mm_s=[..], pump_duty=[..]) → list of param dicts."""
+    keys = list(axes)
+    return [dict(zip(keys, vals)) for vals in itertools.product(*(axes[k] for k in keys))]
+
+def _floats(s):
+    return [float(x) for x in s.split(",") if x]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay a recording under many parameter sets.")
+    ap.add_argument("recording")
+    ap.add_argument("--feeds", type=_floats, default=[0.02, 0.05, 0.1, 0.2])
+    ap.add_argument("--duties", type=_floats, default=[PUMP_DUTY_RUN])
+    ap.add_argument("--i-short", type=_floats, default=[DEFAULT_PARAMS["i_short_mA"]])
+    ap.add_argument("--program", choices=sorted(PROGRAMS), default="feed_to_depth")
+    ap.add_argument("--retracts", type=_floats, default=None, help="peck retract distances (mm)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--top", type=int, default=10)
+    a = ap.parse_args(argv)
+
+    axes = dict(feed_mm_s=a.feeds, pump_duty=a.duties, i_short_mA=a.i_short)
+    if a.retracts:
+        axes["retract_mm"] = a.retracts
+    sets = grid(**axes)
+    print(f"[REPLAY] {len(sets)} parameter sets from {a.recording}")
+    t0 = time.perf_counter()
+    results = sweep(a.recording, sets, program=a.program, workers=a.workers)
+    print(f"[REPLAY] done in {time.perf_counter() - t0:.2f}s")
+    for r in results[:a.top]:
+        p = r["params"]
+        print(f"  cycle={r['cycle_s']:8.1f}s  shorts={r['shorts']:3d}  "
+              f"feed={p['feed_mm_s']:.3f}  duty={p['pump_duty']:.0f}  "
+              f"speedup={r['speedup']:.0f}x  {'ok' if r['complete'] else 'INCOMPLETE'}")
+
+if __name__ == "__main__":
+    sys.exit(main())
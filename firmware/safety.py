@@ -1,5 +1,6 @@
 import time
 import RPi.GPIO as GPIO
+import looptrace
 from config import (ESTOP_PIN, RELAY_PIN, DEBOUNCE_MS, SAFETY_POLL_MS)
 
 GPIO.setmode(GPIO.BCM)
@@ -13,6 +14,7 @@ class SafetyManager:
         self._estop_active = (GPIO.input(ESTOP_PIN) == GPIO.LOW)
         GPIO.add_event_detect(ESTOP_PIN, GPIO.BOTH, callback=self._estop_changed, bouncetime=DEBOUNCE_MS)
 
+    @looptrace.traced("safety.estop_changed")
     def _estop_changed(self, ch):
         pressed = GPIO.input(ESTOP_PIN) == GPIO.LOW
         self._estop_active = pressed
@@ -28,6 +30,7 @@ class SafetyManager:
             GPIO.output(RELAY_PIN, GPIO.HIGH)
 
     def relay_off(self):
+        looptrace.instant("safety.relay_off")
         GPIO.output(RELAY_PIN, GPIO.LOW)
 
     def estop(self):
@@ -1,31 +1,23 @@
 import time
 from typing import Tuple
 
-# Try to use Adafruit INA219; fall back to zeros if not available.
+import looptrace
+
+# Try to use Adafruit INA219; sensors read as NaN if not available.
 try:
-    import board, busio
     from adafruit_ina219 import INA219
     _HAVE_ADA = True
 except Exception:
     _HAVE_ADA = False
 
-from config import (
-    INA_ECM_ADDR, INA_PUMP_ADDR,
-    ECM_SHUNT_OHMS, PUMP_SHUNT_OHMS,
-    ECM_INVERT_SIGN, PUMP_INVERT_SIGN,
-    ECM_I_OFFSET_MA, PUMP_I_OFFSET_MA,
-    CURRENT_EMA_ALPHA,
-)
-
-# Shared I2C
-_I2C = None
-def _get_i2c():
-    global _I2C
-    if not _HAVE_ADA:
-        return None
-    if _I2C is None:
-        _I2C = busio.I2C(board.SCL, board.SDA)
-    return _I2C
+from config import (CURRENT_EMA_ALPHA, I2C_ECM_HZ, I2C_PUMP_HZ)
+import profiles
+from i2cbus import get_bus, nan_tuple, PRIO_HIGH, PRIO_LOW
+
+_NAN4 = nan_tuple(4)
+
+def _read_raw(ina):
+    return (ina.bus_voltage, ina.shunt_voltage, ina.current, ina.power)
 
 class _EMA:
     def __init__(self, alpha: float):
@@ -41,43 +33,88 @@ class PowerSensor:
     """
     INA219 wrapper with simple per-channel scaling and offset.
     Adafruit lib defaults to 0.1Ω; we scale to match actual shunt values.
+    Sampled by the shared I2C bus scheduler at `hz`; read() returns the latest
+    sample and never touches the bus. Failed or stale samples read as NaN.
     """
-    def __init__(self, address: int, shunt_ohms: float, invert_sign: bool, i_offset_mA: float, name: str):
+    def __init__(self, address: int, shunt_ohms: float, invert_sign: bool, i_offset_mA: float, name: str,
+                 hz: float = I2C_PUMP_HZ, priority: int = PRIO_LOW, bus=None, ema_alpha: float = CURRENT_EMA_ALPHA):
         self.name = name
-        self.scale = 0.0
-        self.invert = -1.0 if invert_sign else 1.0
-        self.i_off = float(i_offset_mA)
-        self._ema_i = _EMA(CURRENT_EMA_ALPHA)
+        self.address = address
+        self._ema_i = _EMA(ema_alpha)
         self._ok = False
+        self._bus = None
+        self.configure(shunt_ohms, invert_sign, i_offset_mA)
 
         if _HAVE_ADA:
             try:
-                i2c = _get_i2c()
-                self.ina = INA219(i2c, addr=address)
-                # Adafruit library is calibrated for 0.1Ω typical configs; scale current/power
-                self.scale = 0.1 / float(shunt_ohms if shunt_ohms > 0 else 0.1)
+                self._bus = bus or get_bus()
+                dev = self._bus.add_device(name, opener=lambda i2c: INA219(i2c, addr=address),
+                                           reader=_read_raw, hz=hz, priority=priority,
+                                           on_sample=self._convert)
                 self._ok = True
+                # first sample, so an immediate read() is not NaN
+                t_end = time.monotonic() + 0.1
+                while dev.latest[0] == 0.0 and time.monotonic() < t_end:
+                    time.sleep(0.002)
             except Exception:
                 self._ok = False
 
+    def configure(self, shunt_ohms: float, invert_sign: bool, i_offset_mA: float, ema_alpha: float = None):
+        """Scaling, sign and offset; safe to call while sampling (picked up on the next sample)."""
+        # Adafruit library is calibrated for 0.1Ω typical configs; scale current/power
+        self.scale = 0.1 / float(shunt_ohms if shunt_ohms > 0 else 0.1)
+        self.invert = -1.0 if invert_sign else 1.0
+        self.i_off = float(i_offset_mA)
+        if ema_alpha is not None:
+            self._ema_i.alpha = max(0.0, min(1.0, float(ema_alpha)))
+
+    def _convert(self, raw):
+        """Runs on the bus thread once per new sample: scaling, sign, offset, EMA."""
+        bv, sv, i, p = raw
+        i = i * self.scale * self.invert + self.i_off
+        i = self._ema_i.filt(i)
+        p = p * self.scale * abs(self.invert)   # mW; signless
+        return (bv, sv, i, p)
+
+    @looptrace.traced("sensors.read")
     def read(self) -> Tuple[float, float, float, float]:
-        """Return (bus_V, shunt_V, current_mA, power_mW) with scaling, sign, offset, and EMA."""
+        """Return (bus_V, shunt_V, current_mA, power_mW); NaN if the sample failed or is stale."""
         if not self._ok:
-            return (0.0, 0.0, 0.0, 0.0)
-        try:
-            bv = float(self.ina.bus_voltage)
-            sv = float(self.ina.shunt_voltage)
-            i  = float(self.ina.current) * self.scale * self.invert + self.i_off
-            i  = self._ema_i.filt(i)
-            p  = float(self.ina.power)   * self.scale * abs(self.invert)  # mW; signless
-            return (bv, sv, i, p)
-        except Exception:
-            return (0.0, 0.0, 0.0, 0.0)
+            return _NAN4
+        _t, v = self._bus.latest(self.name)
+        return v if v is not None else _NAN4
 
 class Instrumentation:
-    def __init__(self, use_pump_sensor: bool = False):
-        self.ecm = PowerSensor(INA_ECM_ADDR, ECM_SHUNT_OHMS, ECM_INVERT_SIGN, ECM_I_OFFSET_MA, "ecm")
-        self.pump = PowerSensor(INA_PUMP_ADDR, PUMP_SHUNT_OHMS, PUMP_INVERT_SIGN, PUMP_I_OFFSET_MA, "pump") if use_pump_sensor else None
+    def __init__(self, use_pump_sensor: bool = False, profile: profiles.Profile = None):
+        """profile=None → follow profiles.active(), including runtime switches."""
+        self.profile = p = profile or profiles.active()
+        m = p.machine
+        self.ecm = PowerSensor(m.ina_ecm_addr, m.ecm_shunt_ohms, m.ecm_invert_sign, m.ecm_i_offset_mA, "ecm",
+                               hz=I2C_ECM_HZ, priority=PRIO_HIGH, ema_alpha=m.current_ema_alpha)
+        self.pump = PowerSensor(m.ina_pump_addr, m.pump_shunt_ohms, m.pump_invert_sign, m.pump_i_offset_mA,
+                                "pump", hz=I2C_PUMP_HZ, priority=PRIO_LOW,
+                                ema_alpha=m.current_ema_alpha) if use_pump_sensor else None
+        self._unsubscribe = profiles.subscribe(self.set_profile) if profile is None else None
+
+    def set_profile(self, profile: profiles.Profile):
+        """Re-scale the channels. INA219 addresses are wiring: a change needs a restart."""
+        m = profile.machine
+        if m.ina_ecm_addr != self.ecm.address or (self.pump and m.ina_pump_addr != self.pump.address):
+            print("[SENS] INA219 address change ignored until restart")
+        self.ecm.configure(m.ecm_shunt_ohms, m.ecm_invert_sign, m.ecm_i_offset_mA, m.current_ema_alpha)
+        if self.pump:
+            self.pump.configure(m.pump_shunt_ohms, m.pump_invert_sign, m.pump_i_offset_mA, m.current_ema_alpha)
+        self.profile = profile
+
+    def close(self):
+        """Stop following profile switches."""
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    def bus_stats(self) -> dict:
+        """Per-device I2C throughput and error rates (empty without the INA219 library)."""
+        return self.ecm._bus.stats() if self.ecm._bus else {}
 
     def snapshot(self):
         vb, vs, i, p = self.ecm.read()
@@ -0,0 +1,134 @@
+"""
+ECM Drill – Guarded step loop
+Guard / GuardSet stop conditions and the run_steps() STEP pulse loop.
+No GPIO setup at import: callers (motion.py, or the standalone hardware
+test scripts) configure the pins, so importing this never touches EN.
+"""
+import threading, time
+import RPi.GPIO as GPIO
+from config import STEP_PIN
+
+# ---- guards ----
+class Guard:
+    """
+    A stop condition for a step loop. `check()` returns truthy to trip (a str
+    is used as the trip reason). period_s == 0 → checked inline before every
+    step, so keep it cheap (a GPIO read). period_s > 0 → polled on that cadence
+    by the GuardSet's background thread (I2C reads, timeouts).
+    """
+    def __init__(self, name: str, check, period_s: float = 0.0, message: str = None):
+        self.name = name
+        self.check = check
+        self.period_s = float(period_s)
+        self.message = message or f"[GUARD] {name} tripped"
+
+    def evaluate(self):
+        """Return the trip reason, or None. A failing check does not trip."""
+        try:
+            r = self.check()
+        except Exception:
+            return None
+        if not r:
+            return None
+        return r if isinstance(r, str) else self.message
+
+class GuardSet:
+    """Inline + background guards feeding one trip flag read by the step loop."""
+    def __init__(self, *guards: Guard):
+        self.inline = tuple(g for g in guards if g.period_s <= 0)
+        self.slow = tuple(g for g in guards if g.period_s > 0)
+        self.tripped = False
+        self.reason = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def trip(self, reason: str):
+        """Trip from any thread (slow guards, safety callbacks)."""
+        if not self.tripped:
+            self.reason = reason
+            self.tripped = True
+
+    def reset(self):
+        self.tripped = False
+        self.reason = None
+
+    def poll(self) -> bool:
+        """Called by the step loop before each step."""
+        if self.tripped:
+            return True
+        for g in self.inline:
+            r = g.evaluate()
+            if r:
+                self.trip(r)
+                return True
+        return self.tripped
+
+    def start(self):
+        """Evaluate slow guards once (so the first step is covered), then poll them in the background."""
+        if not self.slow or (self._thread and self._thread.is_alive()):
+            return
+        for g in self.slow:
+            r = g.evaluate()
+            if r:
+                self.trip(r)
+                return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="guards", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        now = time.monotonic()
+        due = [now + g.period_s for g in self.slow]
+        while not self.tripped:
+            if self._stop.wait(max(0.0, min(due) - time.monotonic())):
+                return
+            now = time.monotonic()
+            for k, g in enumerate(self.slow):
+                if now >= due[k]:
+                    due[k] = now + g.period_s
+                    r = g.evaluate()
+                    if r:
+                        self.trip(r)
+                        return
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def run_steps(pulses, step_hz: float, guards: GuardSet = None, every: int = 0, on_progress=None,
+              half_s: float = None) -> int:
+    """
+    Emit up to `pulses` STEP pulses at `step_hz` (pulses=None → until a guard
+    trips). Returns the number of steps taken; `guards.reason` says why it stopped early.
+    `half_s` (Profile.half_period_s) skips the per-call period computation.
+    """
+    if step_hz <= 0:
+        return 0
+    half = half_s or 1.0 / (2.0 * step_hz)
+    out, pin, hi, lo, sleep = GPIO.output, STEP_PIN, GPIO.HIGH, GPIO.LOW, time.sleep
+    poll = guards.poll if guards else None
+    moved = 0
+    if guards:
+        guards.start()
+    try:
+        while pulses is None or moved < pulses:
+            if poll and poll():
+                break
+            out(pin, hi); sleep(half)
+            out(pin, lo); sleep(half)
+            moved += 1
+            if every and moved % every == 0:
+                on_progress(moved)
+    finally:
+        if guards:
+            guards.stop()
+    return moved
@@ -9,13 +9,14 @@ ECM Drill – System Bring-up Test
 Safe defaults: slow speeds, tiny strokes, graceful cleanup.
 """
 
-import time, signal, sys
+import math, time, signal, sys
 import RPi.GPIO as GPIO
 
 from config import (
     RELAY_PIN, PUMP_DUTY_RUN,
     LIMIT_TOP_PIN, LIMIT_BOT_PIN,
     STEPS_PER_MM, MIN_FEED_MM_S, HOME_FEED_MM_S,
+    SAFETY_POLL_MS, PSU_MAX_A,
 )
 
 # ==== USER TUNABLES ====
@@ -24,13 +25,14 @@ MM_STROKE        = 2.0      # small jog distance
 FEED_MM_S        = 0.5      # gentle
 PUMP_STABILIZE_S = 2.0      # time to prime/stabilize flow
 ECM_V_CUT_V      = 2.0      # if bus_V < this, we assume E-STOP/PSU cut
+ECM_I_CEIL_MA    = PSU_MAX_A * 1000.0  # stop if ECM loop current exceeds this
 USE_INA_CHECK    = True     # set False if INA219 not wired yet
 # ========================
 
 # Lazy imports so the script runs even if some modules aren’t installed yet
 from safety import SafetyManager
 from pump   import PumpController
-from motion import MotionController
+from motion import MotionController, Guard, GuardSet, run_steps
 try:
     from sensors import Instrumentation
 except Exception:
@@ -113,43 +115,40 @@ def main():
     # --- Enable motor & perform short jogs with live limit guard ---
     motion.set_enabled(True)
     step_hz = max(FEED_MM_S, MIN_FEED_MM_S) * STEPS_PER_MM
-    half = 1.0 / (2.0 * step_hz)
     pulses = int(MM_STROKE * STEPS_PER_MM)
 
     def limit_blocked(up: bool) -> bool:
         # Stop if moving toward a triggered limit
-        _, top_trig = lim_state(LIMIT_TOP_PIN)
-        _, bot_trig = lim_state(LIMIT_BOT_PIN)
-        return (up and top_trig) or ((not up) and bot_trig)
-
-    def estop_cut_detected() -> bool:
-        if not instr:
-            return False
-        try:
-            s = instr.snapshot()
-            v = float(s.get("ecm_bus_V", 0.0))
-            return v < ECM_V_CUT_V
-        except Exception:
-            return False
+        _, trig = lim_state(LIMIT_TOP_PIN if up else LIMIT_BOT_PIN)
+        return trig
+
+    def power_fault():
+        # One INA219 transaction covers both the PSU-cut and current-ceiling checks.
+        # Failed/stale samples read NaN, which compares False: treat them as a fault.
+        s = instr.snapshot()
+        v = float(s.get("ecm_bus_V", math.nan))
+        i = float(s.get("ecm_I_mA", math.nan))
+        if math.isnan(v) or math.isnan(i):
+            return "[SAFETY] ECM sensor not reading (failed/stale sample) → stopping."
+        if v < ECM_V_CUT_V:
+            return "[SAFETY] Power cut detected (E-STOP/PSU) → stopping."
+        if i > ECM_I_CEIL_MA:
+            return "[SAFETY] ECM current ceiling exceeded → stopping."
+        return None
 
     def jog(up: bool):
         dir_txt = "UP  " if up else "DOWN"
         motion._dir_up(up)
-        moved = 0
-        for _ in range(pulses):
-            if limit_blocked(up):
-                print(f"\n[LIMIT] {dir_txt} blocked → stopping jog.")
-                return
-            if estop_cut_detected():
-                print("\n[SAFETY] Power cut detected (E-STOP/PSU) → stopping.")
-                return
-            GPIO.output(motion.STEP_PIN if hasattr(motion, 'STEP_PIN') else 17, GPIO.HIGH)
-            time.sleep(half)
-            GPIO.output(motion.STEP_PIN if hasattr(motion, 'STEP_PIN') else 17, GPIO.LOW)
-            time.sleep(half)
-            moved += 1
-            if moved % (STEPS_PER_MM // 2 or 1) == 0:
-                show_limits(prefix=f"[MOVE {dir_txt}] ")
+        guards = [Guard("limit", lambda: limit_blocked(up),
+                        message=f"[LIMIT] {dir_txt} blocked → stopping jog.")]
+        if instr:
+            guards.append(Guard("power", power_fault, period_s=SAFETY_POLL_MS / 1000.0))
+        gs = GuardSet(*guards)
+        run_steps(pulses, step_hz, gs, every=(STEPS_PER_MM // 2 or 1),
+                  on_progress=lambda _n: show_limits(prefix=f"[MOVE {dir_txt}] "))
+        if gs.tripped:
+            print(f"\n{gs.reason}")
+            return
         print()
 
     print(f"[MOVE] Jog UP {MM_STROKE} mm @ {FEED_MM_S:.2f} mm/s")
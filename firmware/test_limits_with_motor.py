@@ -16,6 +16,7 @@ from config import (
     LIMIT_TOP_PIN, LIMIT_BOT_PIN,
     STEPS_PER_MM, MIN_FEED_MM_S
 )
+from steploop import Guard, GuardSet, run_steps
 
 # ======= USER TUNABLES =======
 EXPECT_NC_LIMITS  = True     # True for NC→GND wiring (recommended)
@@ -57,28 +58,18 @@ def step_dir(up: bool):
 def do_steps(pulses: int, step_hz: float, up: bool, stop_on_limit=True) -> int:
     """Return number of steps actually taken."""
     step_dir(up)
-    half = 1.0 / (2.0 * step_hz)
-    moved = 0
-    t0 = time.time()
-    for _ in range(pulses):
-        # Stop if moving toward an active limit
-        if stop_on_limit:
-            if up and read_limit(LIMIT_TOP_PIN):
-                print("\n[LIMIT] TOP triggered.")
-                break
-            if (not up) and read_limit(LIMIT_BOT_PIN):
-                print("\n[LIMIT] BOT triggered.")
-                break
-        # Safety timeout
-        if time.time() - t0 > STROKE_TIMEOUT_S:
-            print("\n[SAFETY] Stroke timeout.")
-            break
-        # One step
-        GPIO.output(STEP_PIN, GPIO.HIGH); time.sleep(half)
-        GPIO.output(STEP_PIN, GPIO.LOW);  time.sleep(half)
-        moved += 1
-        if moved % max(1, (STEPS_PER_MM // 2)) == 0:
-            print_limits(prefix="[MOVE] ")
+    deadline = time.monotonic() + STROKE_TIMEOUT_S
+    guards = [Guard("timeout", lambda: time.monotonic() > deadline, period_s=0.1,
+                    message="[SAFETY] Stroke timeout.")]
+    # Stop if moving toward an active limit
+    if stop_on_limit:
+        pin, name = (LIMIT_TOP_PIN, "TOP") if up else (LIMIT_BOT_PIN, "BOT")
+        guards.insert(0, Guard("limit", lambda: read_limit(pin), message=f"[LIMIT] {name} triggered."))
+    gs = GuardSet(*guards)
+    moved = run_steps(pulses, step_hz, gs, every=max(1, (STEPS_PER_MM // 2)),
+                      on_progress=lambda _n: print_limits(prefix="[MOVE] "))
+    if gs.tripped:
+        print(f"\n{gs.reason}")
     return moved
 
 def mm_to_steps(mm: float) -> int:
@@ -6,6 +6,7 @@ import time, sys, signal
 import RPi.GPIO as GPIO
 from config import (STEP_PIN, DIR_PIN, EN_PIN, LIMIT_TOP_PIN, LIMIT_BOT_PIN,
                     STEPS_PER_MM, MIN_FEED_MM_S)
+from steploop import Guard, GuardSet, run_steps
 
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
@@ -25,15 +26,11 @@ def cleanup():
 
 def pulses_at_rate(pulses, step_hz, up):
     GPIO.output(DIR_PIN, GPIO.HIGH if up else GPIO.LOW)
-    half = 1.0 / (2.0 * step_hz)
-    for _ in range(pulses):
-        if (up and top_limit()) or ((not up) and bot_limit()):
-            print("\n[LIMIT] Hit — stopping.")
-            return False
-        GPIO.output(STEP_PIN, GPIO.HIGH)
-        time.sleep(half)
-        GPIO.output(STEP_PIN, GPIO.LOW)
-        time.sleep(half)
+    gs = GuardSet(Guard("limit", top_limit if up else bot_limit, message="[LIMIT] Hit — stopping."))
+    run_steps(pulses, step_hz, gs)
+    if gs.tripped:
+        print(f"\n{gs.reason}")
+        return False
     return True
 
 def main():